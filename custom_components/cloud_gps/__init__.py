@@ -77,6 +77,16 @@ from .const import (
     CONF_PRIVATE_KEY,
     CONF_UPDATE_INTERVAL,
     MQTT_MANAGER,
+    CONF_MQTT_TRANSPORT,
+    MQTT_TRANSPORT_THREAD,
+    CONF_MQTT_QUEUE_SIZE,
+    CONF_MQTT_QUEUE_POLICY,
+    MQTT_QUEUE_DROP_OLDEST,
+    CONF_MQTT_COMMAND_ACK,
+    CONF_MQTT_COMMAND_TIMEOUT,
+    CONF_MQTT_REORDER_WINDOW,
+    CONF_MQTT_PERSISTENT_SESSION,
+    CONF_MQTT_BACKLOG_LIMIT,
 )
 
 TYPE_GEOFENCE = "Geofence"
@@ -85,6 +95,9 @@ __version__ = '2025.6.22'
 _LOGGER = logging.getLogger(__name__)
     
 PLATFORMS = [Platform.DEVICE_TRACKER, Platform.SENSOR, Platform.SWITCH, Platform.BUTTON]
+
+# 构造时额外接收条目选项的数据获取器
+FETCHERS_WITH_OPTIONS = ("macless_haystack", "tuqiang123.com")
    
 WAY_BAIDU = ["/directionlite/v1/driving","/directionlite/v1/riding","/directionlite/v1/walking","/directionlite/v1/transit"]
 WAY_GAODE = ["/v3/direction/driving","/v4/direction/bicycling","/v3/direction/walking","/v3/direction/transit/integrated"]
@@ -137,24 +150,31 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     
     mqtt_manager = None
     if webhost == "gps_mqtt":
-        from .gps_mqtt_data_fetcher import SimpleMQTTManager
-        mqtt_manager = SimpleMQTTManager(hass.loop, username, password)
-        # 在这里连接 MQTT，并由 MQTT Manager 内部维护连接状态
-        try:
-            await mqtt_manager.connect()
-        except Exception as e:
-            _LOGGER.error("MQTT initial connection failed: %s", e)
+        from .gps_mqtt_data_fetcher import async_acquire_mqtt
+        # 同一 MQTT 服务器的条目共享一个连接，这里拿到的是本条目在共享连接上的订阅
+        mqtt_manager = await async_acquire_mqtt(
+            hass, username, password,
+            transport=entry.options.get(CONF_MQTT_TRANSPORT, MQTT_TRANSPORT_THREAD),
+            persistent_session=entry.options.get(CONF_MQTT_PERSISTENT_SESSION, False),
+            backlog_limit=entry.options.get(CONF_MQTT_BACKLOG_LIMIT, 200),
+            queue_size=entry.options.get(CONF_MQTT_QUEUE_SIZE, 1000),
+            queue_policy=entry.options.get(CONF_MQTT_QUEUE_POLICY, MQTT_QUEUE_DROP_OLDEST),
+            command_ack=entry.options.get(CONF_MQTT_COMMAND_ACK, False),
+            command_timeout=entry.options.get(CONF_MQTT_COMMAND_TIMEOUT, 10),
+            reorder_window=entry.options.get(CONF_MQTT_REORDER_WINDOW, 0),
+        )
         
     _LOGGER.debug("%s 集成条目中已启用设备 %s", titlename, device_imei)
     if not device_imei:
         _LOGGER.error("%s 配置中未启用任何设备，请进入配置中设置启用的设备唯一编号。", titlename)
         # 如果没有设备，也应该清理 MQTT 连接（如果已创建）
         if mqtt_manager:
-            await mqtt_manager.stop()
+            from .gps_mqtt_data_fetcher import async_release_mqtt
+            await async_release_mqtt(hass, mqtt_manager)
         return False # 或者抛出异常，阻止集成加载
 
     coordinator = CloudDataUpdateCoordinator(
-        hass, data_fetcher_class, username, password, webhost, gps_conver, device_imei, location_key, update_interval_seconds, address_distance, addressapi, api_key, private_key, mqtt_manager
+        hass, data_fetcher_class, username, password, webhost, gps_conver, device_imei, location_key, update_interval_seconds, address_distance, addressapi, api_key, private_key, mqtt_manager, entry.options
     )
     
     await coordinator.async_refresh()
@@ -209,8 +229,13 @@ async def async_unload_entry(hass, entry):
 
     mqtt_manager = hass.data[DOMAIN][entry.entry_id].get(MQTT_MANAGER)
     if mqtt_manager:
-        _LOGGER.info("Stopping MQTT Manager for entry %s", entry.entry_id)
-        await mqtt_manager.stop()
+        from .gps_mqtt_data_fetcher import async_release_mqtt
+        _LOGGER.info("Releasing MQTT connection for entry %s", entry.entry_id)
+        await async_release_mqtt(hass, mqtt_manager)
+
+    fetcher = hass.data[DOMAIN][entry.entry_id][COORDINATOR]._fetcher
+    if hasattr(fetcher, "async_stop"):
+        await fetcher.async_stop()
 
     if unload_ok:
         hass.data[DOMAIN].pop(entry.entry_id)
@@ -245,7 +270,7 @@ async def async_import_data_fetcher(hass, webhost):
 class CloudDataUpdateCoordinator(DataUpdateCoordinator):
     """Class to manage fetching cloud data API."""
 
-    def __init__(self, hass, data_fetcher_class, username, password, webhost, gps_conver, device_imei, location_key, update_interval_seconds, address_distance, addressapi, api_key, private_key, mqtt_manager=None):
+    def __init__(self, hass, data_fetcher_class, username, password, webhost, gps_conver, device_imei, location_key, update_interval_seconds, address_distance, addressapi, api_key, private_key, mqtt_manager=None, options=None):
         """Initialize."""
         self._hass = hass
         update_interval = (
@@ -269,7 +294,9 @@ class CloudDataUpdateCoordinator(DataUpdateCoordinator):
         self._address = {}
         
         if mqtt_manager and webhost == "gps_mqtt":
-            self._fetcher = data_fetcher_class(hass, mqtt_manager, device_imei, location_key)
+            self._fetcher = data_fetcher_class(hass, mqtt_manager, device_imei, location_key, options)
+        elif webhost in FETCHERS_WITH_OPTIONS:
+            self._fetcher = data_fetcher_class(hass, username, password, device_imei, location_key, options or {})
         else:
             self._fetcher = data_fetcher_class(hass, username, password, device_imei, location_key) 
         
@@ -0,0 +1,93 @@
+"""Per-device movement tracking and shared spatial address cache"""
+import logging
+import math
+from collections import OrderedDict
+
+from homeassistant.util.location import distance
+
+from .const import DOMAIN, ADDRESS_CACHE
+
+_LOGGER = logging.getLogger(__name__)
+
+# 位置变化超过 MOVE_THRESHOLD 米才视为移动；缓存命中半径和容量
+MOVE_THRESHOLD = 20
+ADDRESS_CACHE_RADIUS = 30
+ADDRESS_CACHE_SIZE = 2048
+
+
+class MovementTracker:
+    """按设备记录上次查询地址时的位置，判断设备是否真正移动"""
+
+    def __init__(self, threshold=MOVE_THRESHOLD):
+        self._threshold = threshold
+        self._positions = {}
+
+    def moved(self, imei, lat, lon):
+        """与上次记录的位置比较，移动（或首次出现）时记录新位置并返回 True"""
+        last = self._positions.get(imei)
+        if last is not None and distance(last[0], last[1], lat, lon) <= self._threshold:
+            return False
+        self._positions[imei] = (lat, lon)
+        return True
+
+
+class AddressCache:
+    """
+    按经纬度网格索引的地址缓存：查询点所在格及相邻格中距离不超过 radius 米的最近记录即视为命中，
+    容量超出时淘汰最久未使用的格子。
+    """
+
+    def __init__(self, radius=ADDRESS_CACHE_RADIUS, size=ADDRESS_CACHE_SIZE):
+        self._radius = radius
+        self._size = size
+        self._cell = radius / 111320.0  # 约 radius 米对应的纬度
+        self._cells = OrderedDict()  # (格行, 格列) -> [(lat, lon, address), ...]
+        self.hits = 0
+        self.misses = 0
+
+    def _cell_of(self, lat, lon):
+        return (int(lat // self._cell), int(lon // self._cell))
+
+    def get(self, lat, lon):
+        row, col = self._cell_of(lat, lon)
+        # 经度方向每格的实际距离随纬度缩短，需要多看几列才能覆盖 radius
+        span = math.ceil(1 / max(math.cos(math.radians(lat)), 0.1))
+        best = None
+        best_distance = self._radius
+        for key in ((row + i, col + j) for i in (-1, 0, 1) for j in range(-span, span + 1)):
+            for entry in self._cells.get(key, ()):
+                d = distance(lat, lon, entry[0], entry[1])
+                if d <= best_distance:
+                    best, best_distance = (key, entry), d
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cells.move_to_end(best[0])
+        return best[1][2]
+
+    def put(self, lat, lon, address):
+        if not address:
+            return
+        key = self._cell_of(lat, lon)
+        self._cells.setdefault(key, []).append((lat, lon, address))
+        self._cells.move_to_end(key)
+        while len(self._cells) > self._size:
+            self._cells.popitem(last=False)
+
+    async def async_lookup(self, lat, lon, fetch):
+        """命中缓存直接返回，否则调用 fetch() 协程查询并写入缓存"""
+        address = self.get(lat, lon)
+        if address is None:
+            address = await fetch()
+            self.put(lat, lon, address)
+        _LOGGER.debug("Address cache hits=%d misses=%d", self.hits, self.misses)
+        return address
+
+
+def get_address_cache(hass, webhost):
+    """同一平台的所有集成条目共用一份地址缓存"""
+    caches = hass.data.setdefault(DOMAIN, {}).setdefault(ADDRESS_CACHE, {})
+    if webhost not in caches:
+        caches[webhost] = AddressCache()
+    return caches[webhost]
@@ -40,6 +40,12 @@ varstinydict = {}
 
 AUTOAMAP_API_HOST = "http://ts.amap.com/ws/tservice/internal/link/mobile/get?ent=2&in="
 
+# 速度和方向根据最近一段轨迹估算：最多保留 MOTION_WINDOW_POINTS 个点、MOTION_WINDOW_SECONDS 秒
+MOTION_WINDOW_POINTS = 5
+MOTION_WINDOW_SECONDS = 300
+# 超过此速度（km/h）视为定位漂移，不更新速度
+MOTION_MAX_SPEED = 300
+
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime.datetime):
@@ -62,7 +68,6 @@ class DataFetcher:
         self.trackerdata = {}
         self.vardata = {}
         self.address = {}
-        self.lastgpstime = datetime.datetime.now()
         
         self._store = Store(
             hass, 
@@ -163,6 +168,36 @@ class DataFetcher:
         bearing = math.degrees(math.atan2(y, x))
         return int((bearing + 360) % 360)
         
+    def _fix_time(self, navi_info):
+        """定位时间（秒）：优先使用接口返回的定位时间，没有时使用本次查询时间"""
+        for key in ("locTime", "gpsTime", "time", "timestamp"):
+            value = navi_info.get(key)
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            if value > 1e12:  # 毫秒
+                value /= 1000
+            if value > 1e9:
+                return value
+        return time.time()
+
+    def _estimate_motion(self, track):
+        """
+        由轨迹窗口估算速度（km/h）和方向：速度为窗口内路程除以耗时，方向为窗口起点指向终点。
+        点数不足或结果异常时返回 (None, None)。
+        """
+        if len(track) < 2:
+            return None, None
+        elapsed = track[-1][0] - track[0][0]
+        if elapsed < 1:
+            return None, None
+        path = sum(self.get_distance(p[1], p[2], q[1], q[2]) for p, q in zip(track, track[1:]))
+        speed = path / elapsed * 3.6
+        if speed > MOTION_MAX_SPEED:
+            return None, None
+        return round(speed, 1), self.calculate_bearing(track[0][1], track[0][2], track[-1][1], track[-1][2])
+
     async def _load_persisted_data(self):
         """异步加载持久化数据"""
         try:
@@ -205,10 +240,12 @@ class DataFetcher:
         except Exception as e:
             _LOGGER.error("高德机车 %s 未知错误: %s", self.device_imei, repr(e))
                 
+        changed = False
         for imei in self.device_imei:
             _LOGGER.debug("get info imei: %s", imei)
             #启动后第一次加载重启前保留的数据
-            self.vardata[imei] = self._persisted_data.get("vardata", {}).get(imei,{})
+            if imei not in self.vardata:
+                self.vardata[imei] = self._persisted_data.get("vardata", {}).get(imei,{})
 
             for infodata in devicesinfodata:
                 if infodata.get("tid") == imei:
@@ -229,15 +266,23 @@ class DataFetcher:
                     
                     distance = self.get_distance(thislat, thislon, lastlat, lastlon)
                     status = "停车"
+                    fix_time = self._fix_time(navi_info)
+                    track = self.vardata[imei].setdefault("track", [])
+                    changed = True
                     
                     if distance > 10:
                         _LOGGER.debug("状态为运动: %s ,%s", thislat,thislon)
                         status = "行驶"
-                        distancetime = (datetime.datetime.now() - self.lastgpstime).total_seconds()
-                        if distancetime > 1 and distance < 10000:
-                            self.vardata[imei]["speed"] = round((distance / distancetime * 3.6), 1)
-                            self.vardata[imei]["course"] = self.calculate_bearing(thislat, thislon, lastlat, lastlon)
-                        self.lastgpstime = datetime.datetime.now()
+                        # 每台设备独立的轨迹窗口；刚开始移动时以上次停留的位置和时间作为起点
+                        if not track and (lastlat or lastlon):
+                            track.append([self.vardata[imei].get("lastfixtime", fix_time), lastlat, lastlon])
+                        track.append([fix_time, thislat, thislon])
+                        while len(track) > MOTION_WINDOW_POINTS or (len(track) > 2 and fix_time - track[0][0] > MOTION_WINDOW_SECONDS):
+                            track.pop(0)
+                        speed, course = self._estimate_motion(track)
+                        if speed is not None:
+                            self.vardata[imei]["speed"] = speed
+                            self.vardata[imei]["course"] = course
                         
                         if self.vardata[imei].get("runorstop","run") == "stop":
                             _LOGGER.debug("变成运动: %s ,%s", thislat,thislon)
@@ -252,6 +297,8 @@ class DataFetcher:
                         self.vardata[imei]["laststoptime"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                         self.vardata[imei]["runorstop"] = "stop"
                         self.vardata[imei]["speed"] = 0
+                        track.clear()
+                    self.vardata[imei]["lastfixtime"] = fix_time
                         
                     if infodata.get('naviStatus') == 1:
                         naviStatus = "导航中"
@@ -283,8 +330,6 @@ class DataFetcher:
                     speed =  self.vardata[imei].get("speed",0)
                     course =  self.vardata[imei].get("course",0)
                     
-                    await self._persist_data()
-                    
                     if laststoptime != "" and runorstop ==  "stop":
                         parkingtime=self.time_diff(int(time.mktime(time.strptime(laststoptime, "%Y-%m-%d %H:%M:%S")))) 
                     else:
@@ -315,6 +360,10 @@ class DataFetcher:
                         "attrs": attrs
                     }
 
+        # 所有设备处理完后统一写一次存储
+        if changed:
+            await self._persist_data()
+
         return self.trackerdata
 
 
@@ -32,11 +32,22 @@ from .const import (
     CONF_UPDATE_INTERVAL,
 )
 
+from .token_manager import TokenManager
+
 _LOGGER = logging.getLogger(__name__)
 
 CMOBD_USER_AGENT = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 MicroMessenger/8.0.43(0x18002b2d) NetType/4G Language/zh_CN'
 CMOBD_API_URL = "https://lsapp.cmobd.com/v360/iovsaas"
 
+
+def _is_auth_error(resp):
+    """中移行车卫士登录失效时 result 非 0，note 中提示重新登录"""
+    if not isinstance(resp, dict) or resp.get("result") in (0, None):
+        return False
+    note = str(resp.get("note", ""))
+    return "登录" in note or "token" in note.lower()
+
+
 class DataFetcher:
     """fetch the cloud gps data"""
 
@@ -54,6 +65,8 @@ class DataFetcher:
         self.trackerdata = {}        
         self.address = {}
         self.totalkm = {}
+        # 中移行车卫士使用小程序会话 Token，到期后只能由用户重新抓取
+        self._token_manager = TokenManager(hass, "中移行车卫士", token=password)
         
         headers = {
             'Host': 'lsapp.cmobd.com',                    
@@ -120,10 +133,10 @@ class DataFetcher:
     async def get_data(self):
     
         if self.deviceinfo == {}:
-            deviceslistinfo = await self.hass.async_add_executor_job(self._devicelist_cmobd, self.password)
+            deviceslistinfo = await self._token_manager.async_request(self._devicelist_cmobd, _is_auth_error)
             _LOGGER.debug("deviceslistinfo: %s", deviceslistinfo)
-            if deviceslistinfo.get("result") != 0:
-                _LOGGER.error("请求api错误: %s", deviceslistinfo.get("note"))
+            if not deviceslistinfo or deviceslistinfo.get("result") != 0:
+                _LOGGER.error("请求api错误: %s", deviceslistinfo and deviceslistinfo.get("note"))
                 return
             for deviceinfo in deviceslistinfo["dataList"]:
                 self.deviceinfo[str(deviceinfo["vehicleID"])] = {}
@@ -135,10 +148,10 @@ class DataFetcher:
 
         for imei in self.device_imei:
             _LOGGER.debug("Requests vehicleID: %s", imei)
-                               
+            data = None
             try:
                 async with timeout(10): 
-                    data =  await self.hass.async_add_executor_job(self._get_device_tracker, self.password, imei)
+                    data = await self._token_manager.async_request(self._get_device_tracker, _is_auth_error, imei)
             except ClientConnectorError as error:
                 _LOGGER.error("连接错误: %s", error)
             except asyncio.TimeoutError:
@@ -148,7 +161,7 @@ class DataFetcher:
             finally:
                 _LOGGER.debug("最终数据结果: %s", data)
             
-            if data.get("result") == 0:
+            if data and data.get("result") == 0:
                 querytime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 updatetime = data.get("sampleTime")
                 speed = float(data.get("vehicleSpeed", 0))
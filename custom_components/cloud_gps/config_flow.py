@@ -7,6 +7,7 @@ import requests
 import re
 import hashlib
 import base64
+import struct
 import urllib.parse
 import paho.mqtt.client as mqtt
 import homeassistant.helpers.config_validation as cv
@@ -54,6 +55,30 @@ from .const import (
     KEY_YESTERDAY_DIS,
     KEY_MONTH_DIS,
     KEY_YEAR_DIS,
+    CONF_MQTT_TRANSPORT,
+    MQTT_TRANSPORT_THREAD,
+    MQTT_TRANSPORT_ASYNCIO,
+    CONF_MQTT_CODEC,
+    CONF_MQTT_STRUCT_LAYOUT,
+    CONF_MQTT_SCHEMA,
+    MQTT_CODEC_JSON,
+    MQTT_CODEC_MSGPACK,
+    MQTT_CODEC_CBOR,
+    MQTT_CODEC_STRUCT,
+    CONF_MQTT_QUEUE_SIZE,
+    CONF_MQTT_QUEUE_POLICY,
+    MQTT_QUEUE_DROP_OLDEST,
+    MQTT_QUEUE_KEEP_LATEST,
+    CONF_MQTT_COMMAND_ACK,
+    CONF_MQTT_COMMAND_TIMEOUT,
+    CONF_MQTT_REORDER_WINDOW,
+    CONF_MQTT_PERSISTENT_SESSION,
+    CONF_MQTT_BACKLOG_LIMIT,
+    CONF_DECRYPT_POOL,
+    CONF_DECRYPT_WORKERS,
+    DECRYPT_POOL_THREAD,
+    DECRYPT_POOL_PROCESS,
+    CONF_REFRESH_BATCH_SIZE,
 )
 
 import voluptuous as vol
@@ -132,6 +157,17 @@ def parse_raw_http_to_amap_pwd(raw_http_text: str) -> str:
     }
     return json.dumps(data)
 
+def validate_mqtt_codec_options(user_input):
+    """检查所选 payload 编码可用（msgpack/cbor 依赖可选库）、struct 结构描述可编译，返回表单错误"""
+    from .gps_mqtt_data_fetcher import build_payload_decoder
+    try:
+        build_payload_decoder(user_input.get(CONF_MQTT_CODEC, MQTT_CODEC_JSON), user_input.get(CONF_MQTT_STRUCT_LAYOUT))
+    except ImportError:
+        return {CONF_MQTT_CODEC: "codec_unavailable"}
+    except (ValueError, struct.error):
+        return {CONF_MQTT_STRUCT_LAYOUT: "invalid_struct_layout"}
+    return {}
+
 @config_entries.HANDLERS.register(DOMAIN)
 class FlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
     @staticmethod
@@ -916,7 +952,11 @@ class OptionsFlow(config_entries.OptionsFlow):
 
     async def async_step_user(self, user_input=None):
         """Handle a flow initialized by the user."""
-        if user_input is not None:
+        errors = {}
+        if user_input is not None and self.config_entry.data.get(CONF_WEB_HOST) == "gps_mqtt":
+            # 导入可选库和编译结构描述都涉及文件读取，放到 executor 中
+            errors = await self.hass.async_add_executor_job(validate_mqtt_codec_options, user_input)
+        if user_input is not None and not errors:
             updated_user_input = self.update_password_from_user_input(self._config.get("password"), user_input)
             self._config.update(updated_user_input)
             self.hass.config_entries.async_update_entry(
@@ -1071,10 +1111,7 @@ class OptionsFlow(config_entries.OptionsFlow):
             SWITCHSLIST = []
             BUTTONSLIST = []
                 
-        return self.async_show_form(
-            step_id="user",            
-            data_schema=vol.Schema(
-                {
+        data_schema = {
                     vol.Required(CONF_PASSWORD, default=PWD_NOT_CHANGED): TextSelector(TextSelectorConfig(multiline=True)),
                     vol.Optional(
                         CONF_DEVICE_IMEI, 
@@ -1172,5 +1209,103 @@ class OptionsFlow(config_entries.OptionsFlow):
                         default=self.config_entry.options.get(CONF_PRIVATE_KEY,"")
                     ): str,
                 }
-            ),
+
+        if self.config_entry.data.get(CONF_WEB_HOST) == "gps_mqtt":
+            data_schema[vol.Optional(
+                CONF_MQTT_TRANSPORT,
+                default=self.config_entry.options.get(CONF_MQTT_TRANSPORT, MQTT_TRANSPORT_THREAD)
+            )] = SelectSelector(
+                SelectSelectorConfig(
+                    options=[
+                        {"value": MQTT_TRANSPORT_THREAD, "label": MQTT_TRANSPORT_THREAD},
+                        {"value": MQTT_TRANSPORT_ASYNCIO, "label": MQTT_TRANSPORT_ASYNCIO},
+                    ],
+                    multiple=False,translation_key=CONF_MQTT_TRANSPORT
+                )
+            )
+            data_schema[vol.Optional(
+                CONF_MQTT_CODEC,
+                default=self.config_entry.options.get(CONF_MQTT_CODEC, MQTT_CODEC_JSON)
+            )] = SelectSelector(
+                SelectSelectorConfig(
+                    options=[
+                        {"value": MQTT_CODEC_JSON, "label": MQTT_CODEC_JSON},
+                        {"value": MQTT_CODEC_MSGPACK, "label": MQTT_CODEC_MSGPACK},
+                        {"value": MQTT_CODEC_CBOR, "label": MQTT_CODEC_CBOR},
+                        {"value": MQTT_CODEC_STRUCT, "label": MQTT_CODEC_STRUCT},
+                    ],
+                    multiple=False,translation_key=CONF_MQTT_CODEC
+                )
+            )
+            data_schema[vol.Optional(
+                CONF_MQTT_STRUCT_LAYOUT,
+                default=self.config_entry.options.get(CONF_MQTT_STRUCT_LAYOUT, "")
+            )] = str
+            data_schema[vol.Optional(
+                CONF_MQTT_SCHEMA,
+                default=self.config_entry.options.get(CONF_MQTT_SCHEMA, "")
+            )] = TextSelector(TextSelectorConfig(multiline=True))
+            data_schema[vol.Optional(
+                CONF_MQTT_QUEUE_SIZE,
+                default=self.config_entry.options.get(CONF_MQTT_QUEUE_SIZE, 1000),
+            )] = vol.All(vol.Coerce(int), vol.Range(min=10, max=100000))
+            data_schema[vol.Optional(
+                CONF_MQTT_QUEUE_POLICY,
+                default=self.config_entry.options.get(CONF_MQTT_QUEUE_POLICY, MQTT_QUEUE_DROP_OLDEST)
+            )] = SelectSelector(
+                SelectSelectorConfig(
+                    options=[
+                        {"value": MQTT_QUEUE_DROP_OLDEST, "label": MQTT_QUEUE_DROP_OLDEST},
+                        {"value": MQTT_QUEUE_KEEP_LATEST, "label": MQTT_QUEUE_KEEP_LATEST},
+                    ],
+                    multiple=False,translation_key=CONF_MQTT_QUEUE_POLICY
+                )
+            )
+            data_schema[vol.Optional(
+                CONF_MQTT_COMMAND_ACK,
+                default=self.config_entry.options.get(CONF_MQTT_COMMAND_ACK, False),
+            )] = bool
+            data_schema[vol.Optional(
+                CONF_MQTT_COMMAND_TIMEOUT,
+                default=self.config_entry.options.get(CONF_MQTT_COMMAND_TIMEOUT, 10),
+            )] = vol.All(vol.Coerce(int), vol.Range(min=1, max=120))
+            data_schema[vol.Optional(
+                CONF_MQTT_REORDER_WINDOW,
+                default=self.config_entry.options.get(CONF_MQTT_REORDER_WINDOW, 0),
+            )] = vol.All(vol.Coerce(int), vol.Range(min=0, max=2000))
+            data_schema[vol.Optional(
+                CONF_MQTT_PERSISTENT_SESSION,
+                default=self.config_entry.options.get(CONF_MQTT_PERSISTENT_SESSION, False),
+            )] = bool
+            data_schema[vol.Optional(
+                CONF_MQTT_BACKLOG_LIMIT,
+                default=self.config_entry.options.get(CONF_MQTT_BACKLOG_LIMIT, 200),
+            )] = vol.All(vol.Coerce(int), vol.Range(min=0, max=100000))
+        elif self.config_entry.data.get(CONF_WEB_HOST) == "macless_haystack":
+            data_schema[vol.Optional(
+                CONF_DECRYPT_POOL,
+                default=self.config_entry.options.get(CONF_DECRYPT_POOL, DECRYPT_POOL_THREAD)
+            )] = SelectSelector(
+                SelectSelectorConfig(
+                    options=[
+                        {"value": DECRYPT_POOL_THREAD, "label": DECRYPT_POOL_THREAD},
+                        {"value": DECRYPT_POOL_PROCESS, "label": DECRYPT_POOL_PROCESS},
+                    ],
+                    multiple=False,translation_key=CONF_DECRYPT_POOL
+                )
+            )
+            data_schema[vol.Optional(
+                CONF_DECRYPT_WORKERS,
+                default=self.config_entry.options.get(CONF_DECRYPT_WORKERS, 0),
+            )] = vol.All(vol.Coerce(int), vol.Range(min=0, max=32))
+        elif self.config_entry.data.get(CONF_WEB_HOST) == "tuqiang123.com":
+            data_schema[vol.Optional(
+                CONF_REFRESH_BATCH_SIZE,
+                default=self.config_entry.options.get(CONF_REFRESH_BATCH_SIZE, 50),
+            )] = vol.All(vol.Coerce(int), vol.Range(min=1, max=200))
+
+        return self.async_show_form(
+            step_id="user",
+            data_schema=vol.Schema(data_schema),
+            errors=errors,
         )
\ No newline at end of file
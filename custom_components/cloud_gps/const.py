@@ -56,6 +56,42 @@ COORDINATOR = "coordinator"
 UNDO_UPDATE_LISTENER = "undo_update_listener"
 
 MQTT_MANAGER = "mqtt_manager"
+MQTT_CONNECTIONS = "mqtt_connections"
+INVENTORY_CACHE = "inventory_cache"
+ADDRESS_CACHE = "address_cache"
+TOKEN_MANAGERS = "token_managers"
+
+CONF_MQTT_TRANSPORT = "mqtt_transport"
+MQTT_TRANSPORT_THREAD = "thread"
+MQTT_TRANSPORT_ASYNCIO = "asyncio"
+
+CONF_MQTT_CODEC = "mqtt_codec"
+CONF_MQTT_STRUCT_LAYOUT = "mqtt_struct_layout"
+CONF_MQTT_SCHEMA = "mqtt_schema"
+MQTT_CODEC_JSON = "json"
+MQTT_CODEC_MSGPACK = "msgpack"
+MQTT_CODEC_CBOR = "cbor"
+MQTT_CODEC_STRUCT = "struct"
+
+CONF_MQTT_QUEUE_SIZE = "mqtt_queue_size"
+CONF_MQTT_QUEUE_POLICY = "mqtt_queue_policy"
+MQTT_QUEUE_DROP_OLDEST = "drop_oldest"
+MQTT_QUEUE_KEEP_LATEST = "keep_latest"
+
+CONF_MQTT_COMMAND_ACK = "mqtt_command_ack"
+CONF_MQTT_COMMAND_TIMEOUT = "mqtt_command_timeout"
+
+CONF_MQTT_REORDER_WINDOW = "mqtt_reorder_window"
+
+CONF_MQTT_PERSISTENT_SESSION = "mqtt_persistent_session"
+CONF_MQTT_BACKLOG_LIMIT = "mqtt_backlog_limit"
+
+CONF_DECRYPT_POOL = "decrypt_pool"
+CONF_DECRYPT_WORKERS = "decrypt_workers"
+DECRYPT_POOL_THREAD = "thread"
+DECRYPT_POOL_PROCESS = "process"
+
+CONF_REFRESH_BATCH_SIZE = "refresh_batch_size"
 
 PWD_NOT_CHANGED = "__**password_not_changed**__"
 
@@ -32,11 +32,22 @@ from .const import (
     CONF_UPDATE_INTERVAL,
 )
 
+from .token_manager import TokenManager
+
 _LOGGER = logging.getLogger(__name__)
 
 HELLOBIKE_USER_AGENT = 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 MicroMessenger/8.0.43(0x18002b2d) NetType/4G Language/zh_CN'
 HELLOBIKE_API_URL = "https://a.hellobike.com/evehicle/api"
 
+
+def _is_auth_error(resp):
+    """哈啰 Token 失效时 code 非 0，msg 提示重新登录"""
+    if not isinstance(resp, dict) or resp.get("code") in (0, None):
+        return False
+    msg = str(resp.get("msg", ""))
+    return "登录" in msg or "token" in msg.lower()
+
+
 class DataFetcher:
     """fetch the cloud gps data"""
 
@@ -54,6 +65,8 @@ class DataFetcher:
         self.trackerdata = {}
         self.address = {}
         self.totalkm = {}
+        # 哈啰的 Token 由用户从小程序抓取，没有刷新接口
+        self._token_manager = TokenManager(hass, "哈啰", token=password)
         
         headers = {
             'content-type': 'application/json; charset=utf-8',                    
@@ -106,10 +119,10 @@ class DataFetcher:
     async def get_data(self):
     
         if self.deviceinfo == {}:
-            deviceslistinfo = await self.hass.async_add_executor_job(self._devicelist_hellobike, self._password)
+            deviceslistinfo = await self._token_manager.async_request(self._devicelist_hellobike, _is_auth_error)
             _LOGGER.debug("deviceslistinfo: %s", deviceslistinfo)
-            if deviceslistinfo.get("code") != 0:
-                _LOGGER.error("请求api错误: %s", deviceslistinfo.get("msg"))
+            if not deviceslistinfo or deviceslistinfo.get("code") != 0:
+                _LOGGER.error("请求api错误: %s", deviceslistinfo and deviceslistinfo.get("msg"))
                 return
             for deviceinfo in deviceslistinfo["data"].get("userBikeList"):
                 self.deviceinfo[str(deviceinfo["bikeNo"])] = {}
@@ -121,10 +134,10 @@ class DataFetcher:
 
         for imei in self.device_imei:
             _LOGGER.debug("Requests bikeNo: %s", imei)
-                               
+            data = None
             try:
                 async with timeout(10): 
-                    data =  await self.hass.async_add_executor_job(self._get_device_tracker_hellobike, self._password, imei)           
+                    data = await self._token_manager.async_request(self._get_device_tracker_hellobike, _is_auth_error, imei)
             except ClientConnectorError as error:
                 _LOGGER.error("连接错误: %s", error)
             except asyncio.TimeoutError:
@@ -134,7 +147,7 @@ class DataFetcher:
             finally:
                 _LOGGER.debug("最终数据结果: %s", data)
             
-            if data:
+            if data and data.get("code") == 0:
                 defenceStatus = data["data"]["defenceStatus"]
                 cusionSensorState = data["data"]["cusionSensorState"]
                 mainBatteryEletric = data["data"]["mainBatteryEletric"]
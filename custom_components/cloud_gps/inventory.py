@@ -0,0 +1,63 @@
+"""Per-account device inventory cache"""
+import asyncio
+import logging
+import time
+
+from .const import DOMAIN, INVENTORY_CACHE
+
+_LOGGER = logging.getLogger(__name__)
+
+# 设备记录的有效期；遇到未知 IMEI 时提前刷新，但同一 IMEI 两次刷新至少间隔 INVENTORY_MIN_REFRESH 秒
+INVENTORY_TTL = 6 * 3600
+INVENTORY_MIN_REFRESH = 300
+
+
+class DeviceInventory:
+    """
+    一个账号下的设备清单，按 IMEI 索引并分别记录每条记录的拉取时间。
+    记录过期或遇到清单中没有的 IMEI 时才重新拉取；拉取结果合并进清单，
+    只淘汰本次拉取负责范围内（scope）却没有返回的设备，不影响其它条目拉取的记录。
+    """
+
+    def __init__(self, ttl=INVENTORY_TTL):
+        self._ttl = ttl
+        self._devices = {}
+        self._fetched = {}  # imei -> 记录拉取时间
+        self._attempted = {}  # imei -> 最近一次因该 IMEI 触发拉取的时间
+        self._lock = asyncio.Lock()
+
+    async def async_get(self, imei, fetch_all, scope=None):
+        """
+        返回 imei 对应设备记录的副本，没有时返回 None。
+        fetch_all 为无参协程函数，返回设备记录列表（每条记录带 imei 字段）；
+        scope 为 fetch_all 负责的 IMEI 列表，为 None 时表示整个账号。
+        """
+        imei = str(imei)
+        async with self._lock:
+            now = time.monotonic()
+            if imei in self._devices:
+                stale = now - self._fetched[imei] >= self._ttl
+            else:
+                stale = now - self._attempted.get(imei, -INVENTORY_MIN_REFRESH) >= INVENTORY_MIN_REFRESH
+            if stale:
+                self._attempted[imei] = now
+                records = await fetch_all()
+                devices = {str(record.get("imei")): record for record in records or [] if isinstance(record, dict)}
+                responsible = {str(i) for i in scope} if scope is not None else set(self._devices)
+                for missing in responsible - devices.keys():
+                    self._devices.pop(missing, None)
+                    self._fetched.pop(missing, None)
+                self._devices.update(devices)
+                self._fetched.update(dict.fromkeys(devices, now))
+                _LOGGER.debug("Device inventory refreshed: %d fetched, %d cached", len(devices), len(self._devices))
+        record = self._devices.get(imei)
+        return dict(record) if record is not None else None
+
+
+def get_inventory(hass, webhost, username):
+    """同一账号的多个集成条目共用一份设备清单"""
+    inventories = hass.data.setdefault(DOMAIN, {}).setdefault(INVENTORY_CACHE, {})
+    key = (webhost, username)
+    if key not in inventories:
+        inventories[key] = DeviceInventory()
+    return inventories[key]
@@ -18,12 +18,18 @@ from homeassistant.helpers.update_coordinator import UpdateFailed
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 import math
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+import codecs
+import heapq
+import itertools
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import struct
+import os
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
 from homeassistant.helpers.storage import Store
 from homeassistant.util import slugify
 from zoneinfo import ZoneInfo
@@ -32,6 +38,28 @@ from zoneinfo import ZoneInfo
 # 预定义时区
 SHANGHAI_TZ = ZoneInfo('Asia/Shanghai')
 
+# 曲线对象无状态，所有密钥运算共用一个
+CURVE = ec.SECP224R1()
+
+# 单次请求携带的 hashedAdvKey 数量上限，以及同时进行的请求数
+HAYSTACK_IDS_PER_REQUEST = 100
+HAYSTACK_MAX_CONCURRENT_REQUESTS = 4
+
+# 报告请求窗口（天）的上下限；已处理报告的记录保留到超出最大窗口为止
+HAYSTACK_MIN_DAYS = 1
+HAYSTACK_MAX_DAYS = 7
+
+# 每台设备最多解密的报告数；流式解析时每台设备也只保留这么多份最新报告
+MAX_REPORTS_PER_DEVICE = 5
+
+_RESULTS_ARRAY_RE = re.compile(r'"results"\s*:\s*\[')
+_ARRAY_SEPARATOR_RE = re.compile(r'[\s,]*')
+
+
+def report_fingerprint(report):
+    """报告的去重指纹：加密载荷内含时间戳，载荷哈希即可唯一标识一份报告"""
+    return hashlib.blake2b(report.get("payload", "").encode(), digest_size=8).hexdigest()
+
 from homeassistant.const import (
     CONF_USERNAME,
     CONF_PASSWORD,
@@ -46,6 +74,10 @@ from .const import (
     UNDO_UPDATE_LISTENER,
     CONF_ATTR_SHOW,
     CONF_UPDATE_INTERVAL,
+    CONF_DECRYPT_POOL,
+    CONF_DECRYPT_WORKERS,
+    DECRYPT_POOL_THREAD,
+    DECRYPT_POOL_PROCESS,
 )
 
 _LOGGER = logging.getLogger(__name__)
@@ -56,10 +88,206 @@ class DateTimeEncoder(json.JSONEncoder):
             return obj.isoformat()
         return super().default(obj)
         
+@lru_cache(maxsize=1024)
+def derive_private_key(private_key_b64):
+    """由 base64 私钥派生私钥对象（一次完整的标量乘法，代价较高）"""
+    priv_int = int.from_bytes(base64.b64decode(private_key_b64), byteorder='big', signed=False)
+    return ec.derive_private_key(priv_int, CURVE, default_backend())
+
+def decode_tag(decrypted_data):
+    """解码标签数据，与Dart代码中的_decodePayload匹配"""
+    # 使用struct.unpack获取32位无符号整数
+    latitude = struct.unpack(">I", decrypted_data[0:4])[0] / 10000000.0
+    longitude = struct.unpack(">I", decrypted_data[4:8])[0] / 10000000.0
+    
+    # 准确度和状态直接从字节中提取
+    accuracy = decrypted_data[8]
+    status = decrypted_data[9]
+    
+    # 电池状态解析
+    battery_status = "unknown"
+    # 检查是否支持电池状态更新
+    # if status & 0x20 != 0:
+    battery_bits = (status >> 6) & 0x3
+    if battery_bits == 0:
+        battery_status = "ok"
+    elif battery_bits == 1:
+        battery_status = "medium"
+    elif battery_bits == 2:
+        battery_status = "low"
+    elif battery_bits == 3:
+        battery_status = "criticalLow"
+    
+    return {
+        'lat': latitude,
+        'lon': longitude,
+        'accuracy': accuracy,
+        'status': status,
+        'battery_status': battery_status
+    }
+
+def decrypt_payload(encrypted_payload, private_key):
+    """解密报告，private_key 为缓存的私钥对象，也兼容 base64 私钥字符串"""
+    try:
+        if isinstance(private_key, str):
+            private_key = derive_private_key(private_key)
+        data = base64.b64decode(encrypted_payload)
+        
+        # Dart逻辑：如果长度 > 88，则移除第4个字节
+        if len(data) > 88:
+            _LOGGER.debug("Payload > 88 bytes, removing byte at index 4")
+            modified_data = bytearray()
+            modified_data.extend(data[0:4])
+            modified_data.extend(data[5:])
+            data = bytes(modified_data)
+        
+        # 提取时间戳和置信度
+        timestamp_seconds = int.from_bytes(data[0:4], 'big')
+        confidence = data[4]
+        timestamp = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc) + \
+                    datetime.timedelta(seconds=timestamp_seconds)
+        _LOGGER.debug("Timestamp: %s, Confidence: %d", timestamp, confidence)
+
+        # 提取密钥材料
+        ephemeral_key_bytes = data[5:62]  # 临时公钥 (57字节)
+        enc_data = data[62:72]  # 加密数据 (10字节)
+        auth_tag = data[72:88]  # 认证标签 (16字节)
+        
+        # 临时公钥每份报告不同，私钥使用缓存的对象
+        public_key = ec.EllipticCurvePublicKey.from_encoded_point(CURVE, ephemeral_key_bytes)
+        
+        # 使用 cryptography 的 ECDH 交换
+        shared_key = private_key.exchange(ec.ECDH(), public_key)
+        
+        # 确保共享密钥为28字节 (secp224r1要求)
+        if len(shared_key) < 28:
+            # 前面补零
+            shared_key = b'\x00' * (28 - len(shared_key)) + shared_key
+        elif len(shared_key) > 28:
+            # 截断到28字节
+            shared_key = shared_key[:28]
+        
+        # KDF (密钥派生) - 与Dart的_kdf函数匹配
+        counter = 1
+        counter_bytes = counter.to_bytes(4, 'big')
+        symmetric_key = hashlib.sha256(shared_key + counter_bytes + ephemeral_key_bytes).digest()
+
+        
+        # 分离解密密钥和IV
+        decryption_key = symmetric_key[:16]  # 16字节的解密密钥
+        iv = symmetric_key[16:32]  # 16字节的初始化向量
+
+        # 使用AES-GCM解密 - 匹配Dart的_decryptPayload函数
+        # AESGCM 一次调用完成解密和标签校验（密文后接16字节标签），支持16字节的 IV
+        decrypted = AESGCM(decryption_key).decrypt(iv, enc_data + auth_tag, None)
+        _LOGGER.debug("Decrypted data: %s", decrypted.hex())
+        
+        # 解析标签数据
+        tag = decode_tag(decrypted)
+        tag['timestamp'] = timestamp
+        tag['confidence'] = confidence
+        tag['isodatetime'] = timestamp.isoformat()
+
+        return tag
+        
+    except Exception as e:
+        _LOGGER.error("Decryption failed: %s", str(e), exc_info=True)
+        return None
+
+def process_reports(imei, reports, key_map, lastseentime):
+    """
+    处理设备报告的解密操作，key_map 为 hashedAdvKey -> 私钥对象（线程池）或 base64 私钥（进程池）。
+    模块级函数，可以直接提交到进程池；进程内由 derive_private_key 的缓存避免重复派生私钥。
+    """
+    all_decrypted_data = []
+    
+    for report in reports:
+        report_hashed_adv_key = report["id"]
+        report_payload_b64 = report.get("payload")
+        
+        if not report_payload_b64:
+            continue
+            
+        private_key = key_map.get(report_hashed_adv_key)
+        if not private_key:
+            continue
+            
+        try:
+            # 添加性能监控点
+            start_time = time.time()
+            
+            # 跳过时间戳检查
+            decrypted_data = decrypt_payload(
+                report_payload_b64, 
+                private_key
+            )
+            
+            if decrypted_data:
+                # 添加报告时间用于后续处理
+                decrypted_data['report_time'] = decrypted_data['timestamp'].timestamp()*1000 if report.get("datePublished") is None else report.get("datePublished")
+                all_decrypted_data.append(decrypted_data)
+                
+                # 记录解密耗时
+                duration = time.time() - start_time
+                _LOGGER.debug("Device %s: Decrypted report in %.3fs", imei, duration)
+                
+                # 如果找到足够新的数据，提前停止
+                if decrypted_data['timestamp'].timestamp() > lastseentime + 3600:  # 1小时内的新数据
+                    _LOGGER.debug("Device %s: Found sufficiently new data, skipping further reports", imei)
+                    break
+                    
+            else:
+                _LOGGER.debug("Device %s: Decryption failed for report", imei)
+                
+        except Exception as e:
+            _LOGGER.error("Device %s: Decryption error: %s", imei, repr(e))
+    
+    return all_decrypted_data
+
+
+def parse_results_stream(text_chunks, on_item):
+    """
+    增量解析形如 {..., "results": [{...}, ...], ...} 的响应：逐块读取文本，
+    每解析出一个 results 元素就交给 on_item，已解析的文本立即丢弃，不在内存中保留整个响应。
+    返回 (是否完整解析了 results 数组, 未找到数组时的完整文本)。
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    search_from = 0
+    in_array = False
+    for chunk in text_chunks:
+        buf += chunk
+        if not in_array:
+            match = _RESULTS_ARRAY_RE.search(buf, search_from)
+            if not match:
+                # 键名可能跨块，下次从末尾附近继续查找
+                search_from = max(0, len(buf) - 16)
+                continue
+            buf = buf[match.end():]
+            in_array = True
+        pos = 0
+        while True:
+            pos = _ARRAY_SEPARATOR_RE.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                return True, None
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # 元素还没有接收完整，等待下一块
+                break
+            on_item(item)
+        buf = buf[pos:]
+    if not in_array:
+        return False, buf
+    return False, None
+
+
 class DataFetcher:
     """fetch the cloud gps data"""
 
-    def __init__(self, hass, username, password, device_imei, location_key):
+    def __init__(self, hass, username, password, device_imei, location_key, options=None):
         self.hass = hass
         self.location_key = location_key
         self.username = username
@@ -70,31 +298,35 @@ class DataFetcher:
         self.deviceinfo = {}
         self.trackerdata = {}
         self.lastseentime = 0
+        self._device_lastseen = {}  # 设备ID -> 最新位置时间戳（秒）
+        self._device_fetched = {}  # 设备ID -> 上次成功拉取报告的时间（秒），决定下次的请求窗口
+        self._seen_reports = {}  # 报告指纹 -> 发布时间（毫秒），已处理的报告不再解密
+        self._state_loaded = False
         self._refresh_time = 0
         self.all_device_configs = []
+        self._private_keys = None  # 设备ID -> {hashedAdvKey: 私钥对象}，首次刷新时在线程池中构建
+        
+        # 独立的解密线程池/进程池，不占用 Home Assistant 共享的线程池
+        options = options or {}
+        self._decrypt_pool_mode = options.get(CONF_DECRYPT_POOL, DECRYPT_POOL_THREAD)
+        self._decrypt_workers = int(options.get(CONF_DECRYPT_WORKERS, 0)) or min(4, os.cpu_count() or 1)
+        self._decrypt_executor = None
         try:
-            jsontext = json.loads(self.password)
+            self._raw_device_configs = json.loads(self.password)
         except json.JSONDecodeError as e:
             _LOGGER.error("Failed to parse self.password JSON: %s", e)
+            self._raw_device_configs = []
             
-        # 处理设备配置
-        device = jsontext[0]
-        for device in jsontext:
-            if "hashedAdvKey" not in device or "additionalHashedAdvKeys" not in device:
-                # 计算主私钥的 hashedAdvKey
-                main_private_key = device["privateKey"]
-                device["hashedAdvKey"] = self.calculate_hashed_adv_key(main_private_key)
-
-                # 计算 additionalHashedAdvKeys
-                additional_hashed_keys = []
-                for priv_key in device["additionalKeys"]:
-                    hashed_key = self.calculate_hashed_adv_key(priv_key)
-                    if hashed_key:
-                        additional_hashed_keys.append(hashed_key)
-                device["additionalHashedAdvKeys"] = additional_hashed_keys
-
-            self.all_device_configs.append(device)
-        _LOGGER.debug("all_device_configs: %s", self.all_device_configs)
+        # hashedAdvKey 的派生放到首次刷新时在线程池中完成，结果按密钥列表指纹缓存
+        self._keys_ready = False
+        self._hashed_key_index = {}  # hashedAdvKey -> (设备ID, base64 私钥)，用于合并请求与响应分拣
+        self._device_key_maps = {}  # 设备ID -> {hashedAdvKey: base64 私钥}
+        self._keys_store = Store(
+            hass,
+            version=1,
+            key=f"cloud_gps_{slugify(location_key)}_hashed_keys",
+            private=True,
+        )
 
         # 使用自定义编码器的存储
         self._store = Store(
@@ -106,37 +338,230 @@ class DataFetcher:
         )
 
 
-    def _get_devices_info(self):        
+    async def _async_prepare_keys(self):
+        """
+        补全设备配置中缺少的 hashedAdvKey。密钥列表不变时直接使用 Store 中的结果，
+        否则在线程池中派生后写回 Store，不阻塞事件循环。
+        """
+        pending = [
+            device for device in self._raw_device_configs
+            if "hashedAdvKey" not in device or "additionalHashedAdvKeys" not in device
+        ]
+        if pending:
+            fingerprint = hashlib.sha256(
+                json.dumps([[device.get("privateKey"), device.get("additionalKeys", [])] for device in pending]).encode()
+            ).hexdigest()
+            cached = await self._keys_store.async_load() or {}
+            derived = cached.get("devices")
+            if cached.get("fingerprint") != fingerprint or not isinstance(derived, list) or len(derived) != len(pending):
+                start = time.monotonic()
+                derived = await self.hass.async_add_executor_job(self._derive_hashed_keys, pending)
+                await self._keys_store.async_save({"fingerprint": fingerprint, "devices": derived})
+                _LOGGER.debug("Derived hashedAdvKeys for %d devices in %.3fs", len(pending), time.monotonic() - start)
+            for device, (hashed_key, additional_hashed_keys) in zip(pending, derived):
+                device["hashedAdvKey"] = hashed_key
+                device["additionalHashedAdvKeys"] = additional_hashed_keys
+
+        self.all_device_configs = list(self._raw_device_configs)
+        _LOGGER.debug("all_device_configs: %s", self.all_device_configs)
+        self._build_hashed_key_index()
+        self._keys_ready = True
+
+    def _derive_hashed_keys(self, devices):
+        """计算主私钥和辅助私钥对应的 hashedAdvKey，返回 [[主 hashedAdvKey, [辅助 hashedAdvKey...]], ...]"""
+        derived = []
+        for device in devices:
+            # 计算主私钥的 hashedAdvKey
+            main_hashed_key = self.calculate_hashed_adv_key(device["privateKey"])
+
+            # 计算 additionalHashedAdvKeys
+            additional_hashed_keys = []
+            for priv_key in device.get("additionalKeys", []):
+                hashed_key = self.calculate_hashed_adv_key(priv_key)
+                if hashed_key:
+                    additional_hashed_keys.append(hashed_key)
+            derived.append([main_hashed_key, additional_hashed_keys])
+        return derived
+
+    def _build_hashed_key_index(self):
+        """
+        汇总所有设备的主密钥和辅助密钥，建立 hashedAdvKey -> (设备ID, base64 私钥) 的索引
+        以及每台设备的密钥映射。设备配置在条目生命周期内不变（修改配置会重载条目），只需构建一次。
+        """
+        index = {}
+        device_key_maps = {}
+        for device in self.all_device_configs:
+            device_id = str(device.get("id"))
+            pairs = [(device.get("hashedAdvKey"), device.get("privateKey"))]
+
+            # 处理辅助密钥
+            additional_hashed_keys = device.get("additionalHashedAdvKeys", [])
+            additional_private_keys = device.get("additionalKeys", [])
+            if len(additional_hashed_keys) == len(additional_private_keys):
+                pairs += list(zip(additional_hashed_keys, additional_private_keys))
+            else:
+                _LOGGER.warning("Device %s: Mismatch in lengths of 'additionalHashedAdvKeys' (%d) and 'additionalKeys' (%d). Skipping additional keys mapping.", 
+                                device_id, len(additional_hashed_keys), len(additional_private_keys))
+
+            key_map = device_key_maps.setdefault(device_id, {})
+            for hashed_key, private_key_b64 in pairs:
+                if hashed_key and private_key_b64 and hashed_key not in index:  # 确保值不为空
+                    index[hashed_key] = (device_id, private_key_b64)
+                    key_map[hashed_key] = private_key_b64
+
+        self._hashed_key_index = index
+        self._device_key_maps = device_key_maps
+
+    async def _get_devices_info(self):
+        """
+        一次拉取所有设备的报告：hashedAdvKey 按所属设备需要的请求窗口分组，每组再按上限分块并发请求，
+        结果合并为一个 results 列表。只有全部分块都失败时才返回错误。
+        """
+        now = time.time()
+        groups = {}  # 请求窗口（天） -> hashedAdvKey 列表
+        for hashed_key, (device_id, _) in self._hashed_key_index.items():
+            groups.setdefault(self._request_days(device_id, now), []).append(hashed_key)
+        chunks = [
+            (days, ids[i:i + HAYSTACK_IDS_PER_REQUEST])
+            for days, ids in sorted(groups.items())
+            for i in range(0, len(ids), HAYSTACK_IDS_PER_REQUEST)
+        ]
+        if not chunks:
+            return {"error": "no hashedAdvKey configured"}
+        semaphore = asyncio.Semaphore(HAYSTACK_MAX_CONCURRENT_REQUESTS)
+
+        async def fetch(days, chunk):
+            async with semaphore:
+                return await self.hass.async_add_executor_job(self._fetch_reports, chunk, days)
+
+        responses = await asyncio.gather(*(fetch(days, chunk) for days, chunk in chunks))
+        results = []
+        errors = []
+        failed_devices = set()
+        for (days, chunk), resp in zip(chunks, responses):
+            if not isinstance(resp, dict) or resp.get("error"):
+                errors.append(resp.get("error") if isinstance(resp, dict) else resp)
+                failed_devices.update(self._hashed_key_index[hashed_key][0] for hashed_key in chunk)
+                continue
+            results.extend(resp.get("results") or [])
+        if errors:
+            if len(errors) == len(chunks):
+                return {"error": errors[0]}
+            _LOGGER.warning("%d of %d report requests failed: %s", len(errors), len(chunks), errors[0])
+        # 设备的所有分块都成功才推进拉取时间，失败的设备下次继续按原窗口补拉
+        for device_id in self._device_key_maps:
+            if device_id not in failed_devices:
+                self._device_fetched[device_id] = now
+        _LOGGER.debug("Fetched %d reports for %d keys in %d requests (days: %s)",
+                      len(results), len(self._hashed_key_index), len(chunks),
+                      {days: len(ids) for days, ids in groups.items()})
+        return {"results": results}
+
+    def _request_days(self, device_id, now):
+        """
+        按设备上次成功拉取的时间确定请求窗口，只需覆盖此后发布的报告；长期不上报的设备不会拉大其它设备的窗口。
+        没有拉取记录时参考最近位置时间，两者都没有则按最小窗口请求。
+        """
+        since = self._device_fetched.get(device_id) or self._device_lastseen.get(device_id)
+        if not since:
+            return HAYSTACK_MIN_DAYS
+        days = math.ceil((now - since) / 86400)
+        return max(HAYSTACK_MIN_DAYS, min(HAYSTACK_MAX_DAYS, days))
+
+    def _filter_new_reports(self, reports):
+        """剔除已经处理过的报告"""
+        return [report for report in reports if report_fingerprint(report) not in self._seen_reports]
+
+    def _mark_reports_seen(self, reports):
+        now_ms = int(time.time() * 1000)
+        for report in reports:
+            self._seen_reports[report_fingerprint(report)] = report.get("datePublished") or now_ms
+
+    def _prune_seen_reports(self):
+        """超出最大请求窗口的报告不会再被返回，其记录可以丢弃"""
+        cutoff = (time.time() - (HAYSTACK_MAX_DAYS + 1) * 86400) * 1000
+        self._seen_reports = {key: published for key, published in self._seen_reports.items() if published >= cutoff}
+
+    async def _load_state(self):
+        """首次刷新时恢复已处理报告和各设备最近位置时间"""
+        await self._load_persisted_data()
+        self._seen_reports = dict(self._persisted_data.get("seen_reports", {}))
+        self._device_lastseen = dict(self._persisted_data.get("device_lastseen", {}))
+        self._device_fetched = dict(self._persisted_data.get("device_fetched", {}))
+        self._prune_seen_reports()
+        self._state_loaded = True
+
+    def _fetch_reports(self, ids, days=HAYSTACK_MIN_DAYS):
         url = str.format(self.username.split("||")[0])
         headers = {}
         if self.username.split("||")[1] != "0":
             auth_header = self.basic_auth(self.username.split('||')[1], self.username.split('||')[2])
             headers = {"authorization": auth_header}
         
-        p_data = self.json_format_data(self.all_device_configs[0])
+        p_data = self.json_format_data(ids, days)
         try:
-            response = requests.post(url, headers=headers, json=p_data)
-            if response.status_code == 541:
-                return {"error": response.text}
-            resp = response.json()
-            _LOGGER.debug("resp_json: %s", resp)
-            return resp
+            with requests.post(url, headers=headers, json=p_data, stream=True) as response:
+                if response.status_code == 541:
+                    return {"error": response.text}
+                return self._read_reports(response)
         except requests.exceptions.RequestException as e:
             _LOGGER.error("请求失败: %s", e)
             return {"error": str(e)}
+        except ValueError as e:
+            _LOGGER.error("响应解析失败: %s", e)
+            return {"error": str(e)}
+
+    def _read_reports(self, response):
+        """
+        流式读取报告响应，只保留索引中设备的报告，且每台设备只保留发布时间最新的 MAX_REPORTS_PER_DEVICE 份。
+        响应中没有 results 数组时（如错误信息）按普通 JSON 整体解析。
+        """
+        index = self._hashed_key_index
+        newest = {}  # 设备ID -> 按发布时间的小顶堆
+        counter = itertools.count()
+        parsed = 0
+
+        def keep(report):
+            nonlocal parsed
+            parsed += 1
+            if not isinstance(report, dict):
+                return
+            entry = index.get(report.get("id"))
+            if entry is None:
+                return
+            heap = newest.setdefault(entry[0], [])
+            item = ((report.get("datePublished") or 0, next(counter)), report)
+            if len(heap) < MAX_REPORTS_PER_DEVICE:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heappushpop(heap, item)
+
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+        text_chunks = (decoder.decode(chunk) for chunk in response.iter_content(chunk_size=65536))
+        complete, text = parse_results_stream(text_chunks, keep)
+        if text is not None:
+            resp = json.loads(text + decoder.decode(b"", final=True))
+            _LOGGER.debug("resp_json: %s", resp)
+            if not isinstance(resp, dict) or not isinstance(resp.get("results"), list):
+                return resp
+            for report in resp["results"]:
+                keep(report)
+        elif not complete:
+            raise ValueError("truncated results array")
+
+        results = [report for heap in newest.values() for _, report in heap]
+        _LOGGER.debug("Parsed %d reports, kept %d", parsed, len(results))
+        return {"results": results}
         
     def basic_auth(self, username, password):
         userpass = f"{username}:{password}"
         encoded_credentials = base64.b64encode(userpass.encode('utf-8')).decode('utf-8')
         return "Basic " + encoded_credentials
     
-    def json_format_data(self, data):
-        accessory_id = data.get("id")
-        ids = data.get("additionalHashedAdvKeys")
+    def json_format_data(self, ids, days=HAYSTACK_MIN_DAYS):
         formatted_data = {
-            "accessoryId": accessory_id,
             "ids": ids,
-            "days": 1
+            "days": days
         }
         return formatted_data
     
@@ -149,180 +574,91 @@ class DataFetcher:
     def calculate_hashed_adv_key(self, private_key_b64):
         """计算私钥对应的 hashedAdvKey"""
         try:
-            priv_bytes = base64.b64decode(private_key_b64)
-            priv_int = int.from_bytes(priv_bytes, 'big')
-            private_key = ec.derive_private_key(
-                priv_int, 
-                ec.SECP224R1(),
-                default_backend()
-            )
+            # 派生出的私钥对象进入缓存，随后构建解密私钥缓存时直接复用
+            private_key = derive_private_key(private_key_b64)
             public_key = private_key.public_key()
             x_coord = public_key.public_numbers().x
             x_bytes = x_coord.to_bytes(28, 'big')
             hashed = hashlib.sha256(x_bytes).digest()
             return base64.b64encode(hashed).decode('ascii')
         except Exception as e:
-            print(f"Error processing key: {str(e)}")
+            _LOGGER.error("Error processing key: %s", e)
             return None
 
-    def decode_tag(self, decrypted_data):
-        """解码标签数据，与Dart代码中的_decodePayload匹配"""
-        # 使用struct.unpack获取32位无符号整数
-        latitude = struct.unpack(">I", decrypted_data[0:4])[0] / 10000000.0
-        longitude = struct.unpack(">I", decrypted_data[4:8])[0] / 10000000.0
-        
-        # 准确度和状态直接从字节中提取
-        accuracy = decrypted_data[8]
-        status = decrypted_data[9]
-        
-        # 电池状态解析
-        battery_status = "unknown"
-        # 检查是否支持电池状态更新
-        # if status & 0x20 != 0:
-        battery_bits = (status >> 6) & 0x3
-        if battery_bits == 0:
-            battery_status = "ok"
-        elif battery_bits == 1:
-            battery_status = "medium"
-        elif battery_bits == 2:
-            battery_status = "low"
-        elif battery_bits == 3:
-            battery_status = "criticalLow"
-        
-        return {
-            'lat': latitude,
-            'lon': longitude,
-            'accuracy': accuracy,
-            'status': status,
-            'battery_status': battery_status
-        }
-
-    def decrypt_payload(self, encrypted_payload, private_key_b64):
-        try:
-
-            key_bytes = base64.b64decode(private_key_b64)
-            priv_int = int.from_bytes(key_bytes, byteorder='big', signed=False)
-            data = base64.b64decode(encrypted_payload)
-            
-            # Dart逻辑：如果长度 > 88，则移除第4个字节
-            if len(data) > 88:
-                _LOGGER.debug("Payload > 88 bytes, removing byte at index 4")
-                modified_data = bytearray()
-                modified_data.extend(data[0:4])
-                modified_data.extend(data[5:])
-                data = bytes(modified_data)
-            
-            # 提取时间戳和置信度
-            timestamp_seconds = int.from_bytes(data[0:4], 'big')
-            confidence = data[4]
-            timestamp = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc) + \
-                        datetime.timedelta(seconds=timestamp_seconds)
-            _LOGGER.debug("Timestamp: %s, Confidence: %d", timestamp, confidence)
-
-            # 提取密钥材料
-            ephemeral_key_bytes = data[5:62]  # 临时公钥 (57字节)
-            enc_data = data[62:72]  # 加密数据 (10字节)
-            auth_tag = data[72:88]  # 认证标签 (16字节)
-            
-            # 创建密钥对象
-            curve = ec.SECP224R1()
-            private_key = ec.derive_private_key(priv_int, curve, default_backend())
-            public_key = ec.EllipticCurvePublicKey.from_encoded_point(curve, ephemeral_key_bytes)
-            
-            # 使用 cryptography 的 ECDH 交换
-            shared_key = private_key.exchange(ec.ECDH(), public_key)
-            
-            # 确保共享密钥为28字节 (secp224r1要求)
-            if len(shared_key) < 28:
-                # 前面补零
-                shared_key = b'\x00' * (28 - len(shared_key)) + shared_key
-            elif len(shared_key) > 28:
-                # 截断到28字节
-                shared_key = shared_key[:28]
-            
-            # KDF (密钥派生) - 与Dart的_kdf函数匹配
-            counter = 1
-            counter_bytes = counter.to_bytes(4, 'big')
-            kdf_input = shared_key + counter_bytes + ephemeral_key_bytes
-            symmetric_key = self.sha256(kdf_input)
-
-            
-            # 分离解密密钥和IV
-            decryption_key = symmetric_key[:16]  # 16字节的解密密钥
-            iv = symmetric_key[16:32]  # 16字节的初始化向量
-
-            # 使用AES-GCM解密 - 匹配Dart的_decryptPayload函数
-            # 注意：Dart代码中GCM模式使用tag作为附加认证数据
-            cipher = Cipher(
-                algorithms.AES(decryption_key),
-                modes.GCM(iv, auth_tag, 16),  # 明确指定标签长度为16字节
-                backend=default_backend()
+    def _build_private_key_cache(self):
+        """
+        按设备构建 hashedAdvKey -> 私钥对象 的缓存。
+        密钥集合在条目生命周期内不变，只需在线程池中构建一次。
+        """
+        private_keys = {}
+        for device_id, key_map in self._device_key_maps.items():
+            device_keys = private_keys.setdefault(device_id, {})
+            for hashed_key, private_key_b64 in key_map.items():
+                try:
+                    device_keys[hashed_key] = derive_private_key(private_key_b64)
+                except Exception as e:
+                    _LOGGER.error("Device %s: invalid private key for %s: %s", device_id, hashed_key, e)
+        _LOGGER.debug("Built cached private keys for %d devices", len(private_keys))
+        return private_keys
+
+    def _create_decrypt_executor(self):
+        """在 executor 中创建解密池；进程池同时启动 forkserver 和全部工作进程，避免首次解密时阻塞"""
+        if self._decrypt_pool_mode == DECRYPT_POOL_PROCESS:
+            # forkserver 避免在多线程的 Home Assistant 进程中直接 fork
+            executor = ProcessPoolExecutor(
+                max_workers=self._decrypt_workers, mp_context=multiprocessing.get_context("forkserver")
             )
-            decryptor = cipher.decryptor()
-            
-            # 解密数据
-            decrypted = decryptor.update(enc_data) + decryptor.finalize()
-            _LOGGER.debug("Decrypted data: %s", decrypted.hex())
-            
-            # 解析标签数据
-            tag = self.decode_tag(decrypted)
-            tag['timestamp'] = timestamp
-            tag['confidence'] = confidence
-            tag['isodatetime'] = timestamp.isoformat()
+            for future in [executor.submit(os.getpid) for _ in range(self._decrypt_workers)]:
+                future.result()
+        else:
+            executor = ThreadPoolExecutor(
+                max_workers=self._decrypt_workers, thread_name_prefix="cloud_gps_haystack"
+            )
+        _LOGGER.debug("Created %s decrypt pool with %d workers", self._decrypt_pool_mode, self._decrypt_workers)
+        return executor
+
+    async def _async_get_decrypt_executor(self):
+        if self._decrypt_executor is None:
+            self._decrypt_executor = await self.hass.async_add_executor_job(self._create_decrypt_executor)
+        return self._decrypt_executor
+
+    async def _decrypt_all(self, decrypt_jobs):
+        """
+        所有设备的解密任务同时提交到解密池，结果按设备合并。
+        decrypt_jobs: imei -> 报告列表
+        """
+        if not decrypt_jobs:
+            return {}
+        loop = asyncio.get_running_loop()
+        executor = await self._async_get_decrypt_executor()
+        imeis = list(decrypt_jobs)
+        futures = []
+        for imei in imeis:
+            reports = decrypt_jobs[imei]
+            if self._decrypt_pool_mode == DECRYPT_POOL_PROCESS:
+                # 进程池只能传可序列化的 base64 私钥
+                key_map = self._device_key_maps.get(str(imei), {})
+            else:
+                # 线程池直接使用缓存的私钥对象
+                key_map = self._private_keys.get(str(imei), {})
+            futures.append(loop.run_in_executor(executor, process_reports, imei, reports, key_map, self._device_lastseen.get(imei, 0)))
+        start = time.monotonic()
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        _LOGGER.debug("Decrypted reports for %d devices in %.3fs (%s pool)", len(imeis), time.monotonic() - start, self._decrypt_pool_mode)
+        merged = {}
+        for imei, result in zip(imeis, results):
+            if isinstance(result, Exception):
+                _LOGGER.error("Device %s: Error processing reports: %s", imei, repr(result))
+                continue
+            merged[imei] = result
+        return merged
 
-            return tag
-            
-        except Exception as e:
-            _LOGGER.error("Decryption failed: %s", str(e), exc_info=True)
-            return None
+    async def async_stop(self):
+        """条目卸载时关闭解密池"""
+        if self._decrypt_executor is not None:
+            executor, self._decrypt_executor = self._decrypt_executor, None
+            await self.hass.async_add_executor_job(lambda: executor.shutdown(wait=True, cancel_futures=True))
 
-    def _process_reports_for_device(self, imei, reports, key_map):
-        """处理设备报告的解密操作"""
-        all_decrypted_data = []
-        
-        for report in reports:
-            report_hashed_adv_key = report["id"]
-            report_payload_b64 = report.get("payload")
-            
-            if not report_payload_b64:
-                continue
-                
-            correct_private_key_b64 = key_map.get(report_hashed_adv_key)
-            if not correct_private_key_b64:
-                continue
-                
-            try:
-                # 添加性能监控点
-                start_time = time.time()
-                
-                # 跳过时间戳检查
-                decrypted_data = self.decrypt_payload(
-                    report_payload_b64, 
-                    correct_private_key_b64
-                )
-                
-                if decrypted_data:
-                    # 添加报告时间用于后续处理
-                    decrypted_data['report_time'] = decrypted_data['timestamp'].timestamp()*1000 if report.get("datePublished") is None else report.get("datePublished")
-                    all_decrypted_data.append(decrypted_data)
-                    
-                    # 记录解密耗时
-                    duration = time.time() - start_time
-                    _LOGGER.debug("Device %s: Decrypted report in %.3fs", imei, duration)
-                    
-                    # 如果找到足够新的数据，提前停止
-                    if decrypted_data['timestamp'].timestamp() > self.lastseentime + 3600:  # 1小时内的新数据
-                        _LOGGER.debug("Device %s: Found sufficiently new data, skipping further reports", imei)
-                        break
-                        
-                else:
-                    _LOGGER.debug("Device %s: Decryption failed for report", imei)
-                    
-            except Exception as e:
-                _LOGGER.error("Device %s: Decryption error: %s", imei, repr(e))
-        
-        return all_decrypted_data
-    
     async def _load_persisted_data(self):
         """异步加载持久化数据"""
         try:
@@ -341,6 +677,9 @@ class DataFetcher:
             # 准备要保存的数据，确保所有 datetime 对象都被转换为字符串
             data_to_save = {
                 "trackerdata": self._clean_data_for_storage(self.trackerdata),
+                "seen_reports": self._seen_reports,
+                "device_lastseen": self._device_lastseen,
+                "device_fetched": self._device_fetched,
                 "timestamp": datetime.datetime.now().isoformat()
             }
             
@@ -402,11 +741,23 @@ class DataFetcher:
         
     async def get_data(self): 
         
+        if not self._keys_ready:
+            await self._async_prepare_keys()
+        
+        if not self._state_loaded:
+            await self._load_state()
+        
+        if self._decrypt_executor is None:
+            await self._async_get_decrypt_executor()
+
+        if self._private_keys is None and self._decrypt_pool_mode != DECRYPT_POOL_PROCESS:
+            self._private_keys = await self.hass.async_add_executor_job(self._build_private_key_cache)
+        
         if (int(datetime.datetime.now().timestamp()) - int(self._refresh_time)) >= 60: #限制最快1分钟才请求一次
             devicesinfodata = None
             try:
                 async with timeout(60): 
-                    devicesinfodata = await self.hass.async_add_executor_job(self._get_devices_info)
+                    devicesinfodata = await self._get_devices_info()
                     
             except Exception as e:
                 _LOGGER.error("%s Failed to get data from macless_haystack: %s", self.device_imei, repr(e))
@@ -426,7 +777,19 @@ class DataFetcher:
             if devicesinfodata and not devicesinfodata.get("error"):
                 querytime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-                all_device_configs = self.all_device_configs
+                decrypt_jobs = {}
+
+                # 合并请求的响应只遍历一次，按 hashedAdvKey 索引分拣到各设备
+                if not isinstance(devicesinfodata.get("results"), list):
+                    _LOGGER.error("devicesinfodata is missing or invalid")
+                    return self.trackerdata
+                reports_by_device = {}
+                index = self._hashed_key_index
+                for report in devicesinfodata["results"]:
+                    if isinstance(report, dict):
+                        entry = index.get(report.get("id"))
+                        if entry is not None:
+                            reports_by_device.setdefault(entry[0], []).append(report)
  
                 for imei in self.device_imei:
                     _LOGGER.debug("Processing device with ID (imei): %s", imei)
@@ -434,52 +797,12 @@ class DataFetcher:
                     if self.trackerdata.get(imei):
                         self.trackerdata[imei]["attrs"]["querytime"] = querytime
                     
-                    # 找到当前 imei 对应的设备配置
-                    target_device_config = next((d_config for d_config in all_device_configs if str(d_config.get("id")) == str(imei)), None)
-
-                    if not target_device_config:
-                        _LOGGER.debug("No device configuration found in JSON for ID (imei): %s", imei)
+                    # 设备的密钥映射在启动时已建好
+                    if not self._device_key_maps.get(str(imei)):
+                        _LOGGER.debug("No usable keys found in JSON for ID (imei): %s", imei)
                         continue
 
-                    # 为该设备构建一个 HashedAdvKey -> PrivateKey 的完整映射
-                    key_map = {}
-                    
-                    # 添加主密钥对
-                    if "hashedAdvKey" in target_device_config and "privateKey" in target_device_config:
-                        main_hashed_key = target_device_config["hashedAdvKey"]
-                        main_private_key = target_device_config["privateKey"]
-                        
-                    if main_hashed_key and main_private_key:  # 确保值不为空
-                        key_map[main_hashed_key] = main_private_key
-
-                    # 处理辅助密钥
-                    additional_private_keys = target_device_config.get("additionalKeys", [])
-                    additional_hashed_keys = target_device_config["additionalHashedAdvKeys"]
-
-                    if len(additional_hashed_keys) == len(additional_private_keys):
-                        for i in range(len(additional_hashed_keys)):
-                            h_key = additional_hashed_keys[i]
-                            p_key = additional_private_keys[i]
-                            if h_key and p_key: #确保值不为空
-                                key_map[h_key] = p_key
-                                #_LOGGER.debug("Device %s: Added additional key mapping for HashedAdvKey: %s", imei, h_key)
-                    else:
-                        _LOGGER.warning("Device %s: Mismatch in lengths of 'additionalHashedAdvKeys' (%d) and 'additionalKeys' (%d). Skipping additional keys mapping.", 
-                                        imei, len(additional_hashed_keys), len(additional_private_keys))
-
-                    if not key_map:
-                        _LOGGER.debug("Device %s: No usable keys (main or additional) found after building map.", imei)
-                        continue
-                    
-                    # 从 devicesinfodata["results"] 中筛选出与当前设备任何已知 HashedAdvKey 匹配的报告
-                    if devicesinfodata is None or "results" not in devicesinfodata or not isinstance(devicesinfodata["results"], list):
-                        _LOGGER.error("devicesinfodata is missing or invalid")
-                        continue 
-
-                    matched_reports_for_this_device = []
-                    for report in devicesinfodata["results"]:
-                        if isinstance(report, dict) and report.get("id") in key_map:
-                            matched_reports_for_this_device.append(report)
+                    matched_reports_for_this_device = reports_by_device.get(str(imei), [])
 
                     if not matched_reports_for_this_device:
                         _LOGGER.debug("Device %s: No matching reports", imei)
@@ -492,32 +815,37 @@ class DataFetcher:
                             _LOGGER.warning("请将此%s_devices.json在web端或app端导入测试成功后再加入", imei)
                         continue
 
+                    # 只解密尚未处理过的报告；没有新报告时保持当前数据
+                    new_reports = self._filter_new_reports(matched_reports_for_this_device)
+                    if not new_reports:
+                        _LOGGER.debug("Device %s: No new reports since last cycle", imei)
+                        if not self.trackerdata.get(imei):
+                            self.trackerdata[imei] = self._persisted_data.get("trackerdata", {}).get(imei, {})
+                        continue
+                    matched_reports_for_this_device = new_reports
+
                     # 按报告时间降序排序，优先处理最新报告
                     matched_reports_for_this_device.sort(key=lambda x: x.get("datePublished", 0), reverse=True)
                     
                     # 限制最大解密报告数量
-                    MAX_REPORTS_PER_DEVICE = 5  # 每台设备最多解密5份报告
                     if len(matched_reports_for_this_device) > MAX_REPORTS_PER_DEVICE:
                         _LOGGER.debug("Device %s: Limiting reports from %d to %d", 
                                      imei, len(matched_reports_for_this_device), MAX_REPORTS_PER_DEVICE)
                         matched_reports_for_this_device = matched_reports_for_this_device[:MAX_REPORTS_PER_DEVICE]
                     
-                    # 添加超时保护
-                    try:
-                        # 使用异步执行避免阻塞主线程
-                        all_decrypted_data = await self.hass.async_add_executor_job(
-                            self._process_reports_for_device, 
-                            imei, 
-                            matched_reports_for_this_device, 
-                            key_map
-                        )
-                    except asyncio.TimeoutError:
-                        _LOGGER.warning("Device %s: Report processing timed out", imei)
-                        continue
-                    except Exception as e:
-                        _LOGGER.error("Device %s: Error processing reports: %s", imei, repr(e))
-                        continue
-                    
+                    decrypt_jobs[imei] = matched_reports_for_this_device
+
+                # 所有设备并发解密，再逐个设备合并结果
+                decrypted_results = await self._decrypt_all(decrypt_jobs)
+
+                # 已提交解密的报告（包括解密失败或被提前跳过的较旧报告）记为已处理
+                if decrypt_jobs:
+                    for reports in decrypt_jobs.values():
+                        self._mark_reports_seen(reports)
+                    self._prune_seen_reports()
+                    await self._persist_data()
+
+                for imei, all_decrypted_data in decrypted_results.items():
                     # 如果没有解密出任何数据，继续下一个设备
                     if not all_decrypted_data:
                         _LOGGER.debug("Device %s: No reports successfully decrypted.", imei)
@@ -528,11 +856,12 @@ class DataFetcher:
                     latest_decrypted = max(all_decrypted_data, key=lambda x: x['timestamp'])
                     
                     # 检查这个最新时间戳是否比上次记录的时间更新
-                    if int(latest_decrypted['timestamp'].timestamp()) > self.lastseentime or self.trackerdata.get(imei)==None:
+                    if int(latest_decrypted['timestamp'].timestamp()) > self._device_lastseen.get(imei, 0) or not self.trackerdata.get(imei):
                         _LOGGER.debug("Device %s: Using latest decrypted data with isodatetime: %s", imei, latest_decrypted['isodatetime'])
                         
                         # 更新 lastseentime
-                        self.lastseentime = int(latest_decrypted['timestamp'].timestamp())
+                        self._device_lastseen[imei] = int(latest_decrypted['timestamp'].timestamp())
+                        self.lastseentime = max(self.lastseentime, self._device_lastseen[imei])
 
                         # 处理解密数据
                         lastseen = latest_decrypted.get('isodatetime')            
@@ -558,7 +887,7 @@ class DataFetcher:
                         await self._persist_data()
                     else:
                         _LOGGER.debug("Device %s: Latest decrypted data is not newer than existing data. Latest timestamp: %s, Last seen: %s", 
-                                      imei, latest_decrypted['isodatetime'], datetime.datetime.fromtimestamp(self.lastseentime).isoformat())
+                                      imei, latest_decrypted['isodatetime'], datetime.datetime.fromtimestamp(self._device_lastseen.get(imei, 0)).isoformat())
                 
         else:
             _LOGGER.debug("时间小于1分钟，不请求数据")
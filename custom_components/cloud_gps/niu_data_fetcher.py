@@ -1,10 +1,14 @@
 import logging
+import asyncio
 import requests
 import json
 import time
 import datetime
 import hashlib
 from time import gmtime, strftime
+from homeassistant.util import slugify
+
+from .token_manager import get_token_manager, remove_token_manager
 
 # 保持与其他模块一致的引用
 from .const import (
@@ -15,6 +19,7 @@ from .const import (
     KEY_LASTONLINETIME,
     KEY_LASTOFFLINETIME,
     KEY_LASTSEEN,
+    KEY_QUERYTIME,
     KEY_SPEED,
     KEY_TOTALKM,
     KEY_STATUS,
@@ -43,6 +48,15 @@ URL_MOTOR_INDEX = "/v3/motor_data/index_info" # 车辆核心状态(GPS, 锁, 开
 URL_BATTERY_INFO = "/v3/motor_data/battery_info" # 电池信息
 URL_OVERALL_TALLY = "/v3/motoinfo/overallTally" # 总里程等统计
 
+# 各数据层级的刷新间隔（秒）；车辆状态和位置每次轮询都刷新
+BATTERY_INTERVAL = 300
+TALLY_INTERVAL = 3600
+VEHICLE_LIST_INTERVAL = 6 * 3600
+VEHICLE_LIST_RETRY = 300
+
+# Token 失效时接口返回的 status
+NIU_AUTH_ERRORS = (1021, 1022)
+
 class DataFetcher:
     """Fetch the cloud gps data for NIU."""
 
@@ -53,10 +67,21 @@ class DataFetcher:
         self.device_imei = device_imei  # 在小牛这里，配置的 IMEI 实际对应 SN
         self.location_key = location_key
         self.token = None
-        self.token_expire_time = 0
+        self._auth_error = False
+        # Token 到期前在后台重新登录并持久化，轮询路径上不再登录；同一账号的按钮和开关共用
+        self._token_key = ("niu", username)
+        self._token_manager = get_token_manager(
+            hass, self._token_key, "NIU", login=self._login, store_key=f"cloud_gps_niu_{slugify(username)}_token"
+        )
         
         # 缓存数据
         self.trackerdata = {}
+        self._vehicle_map = {}
+        self._vehicle_list_time = 0
+        self._battery = {}
+        self._battery_time = {}
+        self._tally = {}
+        self._tally_time = {}
         
         # Session 设置
         self.session = requests.Session()
@@ -66,12 +91,8 @@ class DataFetcher:
             'Connection': 'keep-alive'
         })
 
-    def _get_token(self):
-        """获取小牛 API Token"""
-        # 如果 Token 还在有效期内（假设有效期 1 小时，这里设置 3000 秒缓冲），直接复用
-        if self.token and time.time() < self.token_expire_time:
-            return self.token
-
+    def _login(self):
+        """登录小牛账号，返回 (access_token, 有效秒数)，失败返回 None"""
         url = NIU_ACCOUNT_BASE_URL + URL_LOGIN
         md5_password = hashlib.md5(self.password.encode("utf-8")).hexdigest()
         data = {
@@ -87,11 +108,9 @@ class DataFetcher:
             if r.status_code == 200:
                 resp = r.json()
                 if resp.get("status") == 0 and "data" in resp:
-                    self.token = resp["data"]["token"]["access_token"]
-                    # 简单设定过期时间为当前时间 + 3600秒
-                    self.token_expire_time = time.time() + resp["data"]["token"].get("refresh_expires_in", 3600)
+                    token = resp["data"]["token"]
                     _LOGGER.debug("NIU Token refreshed successfully.")
-                    return self.token
+                    return token["access_token"], token.get("token_expires_in") or token.get("refresh_expires_in", 3600)
                 else:
                     _LOGGER.error(f"NIU Login failed: {resp.get('desc')}")
         except Exception as e:
@@ -100,10 +119,9 @@ class DataFetcher:
         return None
 
     def _api_request(self, method, endpoint, params=None, data=None):
-        """通用的 API 请求封装"""
+        """通用的 API 请求封装，Token 由 get_data 通过 TokenManager 准备"""
         if not self.token:
-            if not self._get_token():
-                return None
+            return None
 
         url = NIU_API_BASE_URL + endpoint
         headers = {"token": self.token}
@@ -121,8 +139,8 @@ class DataFetcher:
                 else:
                     _LOGGER.warning(f"NIU API Error [{endpoint}]: {json_data.get('desc')}")
                     # 如果 token 失效 (通常 status 可能是特定的 code，这里简单处理重试逻辑)
-                    if json_data.get("status") in [1021, 1022]: # 假设的 token 失效码，需根据实际情况调整
-                        self.token = None 
+                    if json_data.get("status") in NIU_AUTH_ERRORS:
+                        self._auth_error = True
             return None
         except Exception as e:
             _LOGGER.error(f"NIU API Connection Error [{endpoint}]: {e}")
@@ -177,146 +195,179 @@ class DataFetcher:
     async def get_data(self):
         """
         主入口：被 Coordinator 调用。
+        车辆状态和位置每次轮询都请求，电池、总里程和车辆列表按各自的间隔刷新；
+        同一层级的请求对所有车辆并发执行（在 executor 中运行同步的 requests 代码，防止阻塞 HA 主循环）。
         """
-        # 在 executor 中运行同步的 requests 代码，防止阻塞 HA 主循环
-        return await self.hass.async_add_executor_job(self._get_data_sync)
-
-    def _get_data_sync(self):
-        """同步获取数据的逻辑"""
-        
         # 1. 确保 Token
-        if not self._get_token():
+        if not await self._async_update_token(self._token_manager.async_get_token()):
             return self.trackerdata
 
-        # 2. 获取账户下所有车辆，用于验证配置的 SN 是否存在以及获取基础信息
-        vehicles_data = self._get_vehicle_list()
-        if not vehicles_data or "items" not in vehicles_data:
-            return self.trackerdata
+        now = time.time()
 
-        vehicle_map = {v["sn_id"]: v for v in vehicles_data["items"]}
+        # 2. 车辆列表变化很少，长间隔刷新；配置了列表中没有的 SN 时提前刷新
+        missing = [sn for sn in self.device_imei if sn not in self._vehicle_map]
+        if now - self._vehicle_list_time >= VEHICLE_LIST_INTERVAL or (missing and now - self._vehicle_list_time >= VEHICLE_LIST_RETRY):
+            vehicles_data = await self.hass.async_add_executor_job(self._get_vehicle_list)
+            if vehicles_data and "items" in vehicles_data:
+                self._vehicle_map = {v["sn_id"]: v for v in vehicles_data["items"]}
+                self._vehicle_list_time = now
+            elif not self._vehicle_map:
+                return self.trackerdata
 
-        # 3. 遍历配置的设备 (device_imei 在这里当作 SN 使用)
+        sns = []
         for sn in self.device_imei:
-            _LOGGER.debug(f"Fetching NIU data for SN: {sn}")
-            
-            if sn not in vehicle_map:
+            if sn in self._vehicle_map:
+                sns.append(sn)
+            else:
                 _LOGGER.warning(f"Device SN {sn} not found in NIU account.")
-                continue
-            
-            # 基础设备信息
-            base_info = vehicle_map[sn]
-            device_model = base_info.get("scooter_name", "小牛电动车")
-            
-            # --- API 1: 核心状态 (GPS, Speed, Lock) ---
-            motor_data = self._get_motor_info(sn)
+
+        # 3. 按层级并发请求：状态每次都取，电池和总里程到期才取
+        motor = await self._fetch_all(self._get_motor_info, sns)
+        if self._auth_error:
+            # Token 被服务端提前作废：重新登录一次后重试
+            if not await self._async_update_token(self._token_manager.async_invalidate(self.token)):
+                return self.trackerdata
+            motor = await self._fetch_all(self._get_motor_info, sns)
+        battery_due = [sn for sn in sns if now - self._battery_time.get(sn, 0) >= BATTERY_INTERVAL]
+        tally_due = [sn for sn in sns if now - self._tally_time.get(sn, 0) >= TALLY_INTERVAL]
+        for sn, data in (await self._fetch_all(self._get_battery_info, battery_due)).items():
+            if data:
+                self._battery[sn] = data
+                self._battery_time[sn] = now
+        for sn, data in (await self._fetch_all(self._get_overall_tally, tally_due)).items():
+            if data:
+                self._tally[sn] = data
+                self._tally_time[sn] = now
+        _LOGGER.debug("NIU poll requests: motor=%d battery=%d tally=%d", len(sns), len(battery_due), len(tally_due))
+
+        # 4. 遍历配置的设备 (device_imei 在这里当作 SN 使用)
+        for sn in sns:
+            motor_data = motor.get(sn)
             if not motor_data:
                 continue
+            self._process_vehicle(sn, self._vehicle_map[sn], motor_data, self._battery.get(sn), self._tally.get(sn))
 
-            # --- API 2: 电池信息 ---
-            battery_data = self._get_battery_info(sn)
-            
-            # --- API 3: 总里程 ---
-            tally_data = self._get_overall_tally(sn)
+        return self.trackerdata
 
-            # --- 数据解析与组装 ---
-            
-            # GPS 坐标 (NIU API 返回的通常是 GCJ02，CloudGPS 的 coordinator 会处理转换，这里只管传原始值)
-            # 注意: NIU API 返回的 postion 字段可能拼写错误为 "postion" 或 "position"，视版本而定
-            pos_data = motor_data.get("postion", {}) 
-            lat = float(pos_data.get("lat", 0))
-            lon = float(pos_data.get("lng", 0))
-            gps_precision = motor_data.get("hdop", 0)
-
-            # 状态判断
-            is_connected = motor_data.get("isConnected", 0) == 1
-            lock_status = motor_data.get("lockStatus", 0) # 1: Locked, 0: Unlocked
-            is_charging = motor_data.get("isCharging", 0)
-            now_speed = float(motor_data.get("nowSpeed", 0))
-
-            # 在线状态
-            online_status = "在线" if is_connected else "离线"
-            
-            # 运行状态 & ACC
-            acc_status = "未知"
-            if lock_status == 1:
-                acc_status = "已锁车"
-                status = "停车"
-            else:
-                acc_status = "已开锁" # 对应 ACC ON
-                status = "行驶" if now_speed > 0 else "钥匙开启"
-
-            if not is_connected:
-                status = "离线"
-
-            run_or_stop = "运动" if now_speed > 0 else "静止"
-
-            # 电池数据处理
-            battery_level = 0
-            battery_status_str = "未充电"
-            if battery_data and "batteries" in battery_data:
-                # 通常取 compartmentA
-                comp_a = battery_data["batteries"].get("compartmentA", {})
-                battery_level = comp_a.get("batteryCharging", 0)
-                if comp_a.get("isConnected"):
-                    battery_status_str = "充电中" if is_charging else "放电中"
-            
-            # 辅助信息
-            estimated_mileage = motor_data.get("estimatedMileage", 0) # 预估剩余里程
-            left_time = motor_data.get("leftTime", "") # 剩余时间/停车时间信息?
-            # 注意：leftTime 含义在小牛API中经常变化，有时是预估剩余骑行时间，有时是最后更新时间
-            # 我们尽量从 lastTrack 获取时间
-            
-            last_track = motor_data.get("lastTrack", {})
-            last_update_time_ms = last_track.get("time", 0)
-            last_update_str = self._parse_time(last_update_time_ms)
-            
-            # 停车时长计算 (依赖于最后更新时间)
-            parking_time = "未知"
-            if now_speed == 0:
-                parking_time = self._calculate_parking_time(last_update_str)
-
-            # 总里程
-            total_km = 0
-            if tally_data:
-                total_km = tally_data.get("totalMileage", 0)
-
-            # 组装 Attributes (Key 必须与 const.py 对应)
-            attrs = {
-                KEY_SPEED: now_speed,
-                KEY_STATUS: status,
-                KEY_ACC: acc_status,
-                KEY_RUNORSTOP: run_or_stop,
-                "onlinestatus": online_status,
-                KEY_LASTSEEN: last_update_str,
-                KEY_QUERYTIME: datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                KEY_PARKING_TIME: parking_time,
-                KEY_BATTERY: battery_level, # 实际上是百分比
-                KEY_BATTERY_STATUS: battery_status_str,
-                KEY_TOTALKM: total_km,
-                "estimated_range": estimated_mileage, # 额外属性
-                "gps_accuracy": gps_precision
-            }
-            
-            # 兼容 CloudGPS 的 deviceinfo 结构
-            device_info = {
-                "device_model": device_model,
-                "sw_version": "Cloud API",
-                "expiration": "永久"
-            }
-
-            # 写入结果字典
-            self.trackerdata[sn] = {
-                "location_key": self.location_key + str(sn),
-                "deviceinfo": device_info,
-                "thislat": lat,
-                "thislon": lon,
-                "status": status,
-                "attrs": attrs
-            }
-            
-            _LOGGER.debug(f"NIU Data for {sn} processed: {status}, Bat: {battery_level}%")
+    async def _async_update_token(self, token_coro):
+        token = await token_coro
+        if not token:
+            return False
+        self.token = token
+        return True
+
+    async def async_stop(self):
+        """条目卸载时取消后台刷新"""
+        remove_token_manager(self.hass, self._token_key)
+
+    async def _fetch_all(self, request, sns):
+        """对多台车辆并发执行同一个请求，返回 sn -> 数据；_auth_error 只反映本次请求的结果"""
+        self._auth_error = False
+        if not sns:
+            return {}
+        results = await asyncio.gather(*(self.hass.async_add_executor_job(request, sn) for sn in sns))
+        return dict(zip(sns, results))
+
+    def _process_vehicle(self, sn, base_info, motor_data, battery_data, tally_data):
+        """解析一台车辆的数据并写入 trackerdata"""
+        _LOGGER.debug(f"Processing NIU data for SN: {sn}")
+        device_model = base_info.get("scooter_name", "小牛电动车")
+
+        # GPS 坐标 (NIU API 返回的通常是 GCJ02，CloudGPS 的 coordinator 会处理转换，这里只管传原始值)
+        # 注意: NIU API 返回的 postion 字段可能拼写错误为 "postion" 或 "position"，视版本而定
+        pos_data = motor_data.get("postion", {}) 
+        lat = float(pos_data.get("lat", 0))
+        lon = float(pos_data.get("lng", 0))
+        gps_precision = motor_data.get("hdop", 0)
+
+        # 状态判断
+        is_connected = motor_data.get("isConnected", 0) == 1
+        lock_status = motor_data.get("lockStatus", 0) # 1: Locked, 0: Unlocked
+        is_charging = motor_data.get("isCharging", 0)
+        now_speed = float(motor_data.get("nowSpeed", 0))
+
+        # 在线状态
+        online_status = "在线" if is_connected else "离线"
+        
+        # 运行状态 & ACC
+        acc_status = "未知"
+        if lock_status == 1:
+            acc_status = "已锁车"
+            status = "停车"
+        else:
+            acc_status = "已开锁" # 对应 ACC ON
+            status = "行驶" if now_speed > 0 else "钥匙开启"
+
+        if not is_connected:
+            status = "离线"
+
+        run_or_stop = "运动" if now_speed > 0 else "静止"
+
+        # 电池数据处理
+        battery_level = 0
+        battery_status_str = "未充电"
+        if battery_data and "batteries" in battery_data:
+            # 通常取 compartmentA
+            comp_a = battery_data["batteries"].get("compartmentA", {})
+            battery_level = comp_a.get("batteryCharging", 0)
+            if comp_a.get("isConnected"):
+                battery_status_str = "充电中" if is_charging else "放电中"
+        
+        # 辅助信息
+        estimated_mileage = motor_data.get("estimatedMileage", 0) # 预估剩余里程
+        left_time = motor_data.get("leftTime", "") # 剩余时间/停车时间信息?
+        # 注意：leftTime 含义在小牛API中经常变化，有时是预估剩余骑行时间，有时是最后更新时间
+        # 我们尽量从 lastTrack 获取时间
+        
+        last_track = motor_data.get("lastTrack", {})
+        last_update_time_ms = last_track.get("time", 0)
+        last_update_str = self._parse_time(last_update_time_ms)
+        
+        # 停车时长计算 (依赖于最后更新时间)
+        parking_time = "未知"
+        if now_speed == 0:
+            parking_time = self._calculate_parking_time(last_update_str)
+
+        # 总里程
+        total_km = 0
+        if tally_data:
+            total_km = tally_data.get("totalMileage", 0)
+
+        # 组装 Attributes (Key 必须与 const.py 对应)
+        attrs = {
+            KEY_SPEED: now_speed,
+            KEY_STATUS: status,
+            KEY_ACC: acc_status,
+            KEY_RUNORSTOP: run_or_stop,
+            "onlinestatus": online_status,
+            KEY_LASTSEEN: last_update_str,
+            KEY_QUERYTIME: datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            KEY_PARKING_TIME: parking_time,
+            KEY_BATTERY: battery_level, # 实际上是百分比
+            KEY_BATTERY_STATUS: battery_status_str,
+            KEY_TOTALKM: total_km,
+            "estimated_range": estimated_mileage, # 额外属性
+            "gps_accuracy": gps_precision
+        }
+        
+        # 兼容 CloudGPS 的 deviceinfo 结构
+        device_info = {
+            "device_model": device_model,
+            "sw_version": "Cloud API",
+            "expiration": "永久"
+        }
 
-        return self.trackerdata
+        # 写入结果字典
+        self.trackerdata[sn] = {
+            "location_key": self.location_key + str(sn),
+            "deviceinfo": device_info,
+            "thislat": lat,
+            "thislon": lon,
+            "status": status,
+            "attrs": attrs
+        }
+        
+        _LOGGER.debug(f"NIU Data for {sn} processed: {status}, Bat: {battery_level}%")
 
 class DataButton:
     def __init__(self, hass, username, password, imei, mqtt_manager=None):
@@ -326,21 +377,23 @@ class DataButton:
 
     async def _action(self, command_type):
         """发送控制指令"""
-        # 在 executor 中运行，防止阻塞
-        return await self.hass.async_add_executor_job(self._send_command_sync, command_type)
-
-    def _send_command_sync(self, command_type):
-        # 确保获取到 Token
-        if not self.fetcher._get_token():
+        # 在 executor 中运行，防止阻塞；Token 被服务端作废时重新登录后重发一次
+        result = await self.fetcher._token_manager.async_request(
+            self._send_command_sync, lambda r: r[1], command_type
+        )
+        if result is None:
             return "Token获取失败"
+        return result[0]
 
+    def _send_command_sync(self, token, command_type):
+        """返回 (结果, Token 是否失效)"""
         # 这里使用验证过的发送指令 API
         # 注意：小牛发指令通常需要 SN，而 DataButton 初始化传入的 imei 即为 SN
         sn = self.fetcher.device_imei[0] 
         url = NIU_API_BASE_URL + "/v5/cmd/creat"
 
         headers = {
-            "token": self.fetcher.token,
+            "token": token,
             "Content-Type": "application/json; charset=utf-8",
             # 发送指令最好模拟 iOS 客户端，成功率较高
             "User-Agent": "manager/5.12.4 (iPhone; iOS 18.5; Scale/3.00);deviceName=iPhone;timezone=Asia/Shanghai;model=iPhone13,4;lang=zh-CN;ostype=iOS;clientIdentifier=Domestic"
@@ -353,14 +406,14 @@ class DataButton:
                 resp = r.json()
                 if resp.get("status") == 0:
                     _LOGGER.info(f"NIU Command {command_type} success.")
-                    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), False
                 else:
                     _LOGGER.error(f"NIU Command failed: {resp}")
-                    return "指令发送失败"
+                    return "指令发送失败", resp.get("status") in NIU_AUTH_ERRORS
         except Exception as e:
             _LOGGER.error(f"NIU Command Error: {e}")
-            return "网络错误"
-        return "未知错误"
+            return "网络错误", False
+        return "未知错误", False
         
 class DataSwitch:
     def __init__(self, hass, username, password, imei, mqtt_manager=None):
@@ -0,0 +1,184 @@
+"""Token lifecycle management for cloud platforms"""
+import asyncio
+import base64
+import json
+import logging
+import time
+
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+
+from .const import DOMAIN, TOKEN_MANAGERS
+
+_LOGGER = logging.getLogger(__name__)
+
+# 到期前 TOKEN_REFRESH_MARGIN 秒在后台刷新；静态 Token 到期前 TOKEN_EXPIRY_WARNING 秒开始提示
+TOKEN_REFRESH_MARGIN = 600
+TOKEN_EXPIRY_WARNING = 86400
+# 刷新失败后的重试间隔（秒），每次失败翻倍，不超过上限
+TOKEN_RETRY_MIN = 60
+TOKEN_RETRY_MAX = 1800
+
+
+def jwt_expiry(token):
+    """Token 为 JWT 时返回其 exp（秒），否则返回 None"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
+
+class TokenManager:
+    """
+    记录 Token 的到期时间并持久化，到期前在后台重新登录，轮询时直接使用缓存的 Token。
+    login 为同步函数，返回 (token, 有效秒数)，失败返回 None；为 None 时表示静态 Token
+    （平台没有刷新接口），只记录到期时间并在到期前提示。
+    """
+
+    def __init__(self, hass, name, login=None, store_key=None, token=None):
+        self.hass = hass
+        self._name = name
+        self._login = login
+        self._store = Store(hass, version=1, key=store_key, private=True) if store_key else None
+        self._loaded = self._store is None
+        self.token = token
+        self.expires_at = jwt_expiry(token) if token else None
+        self._lock = asyncio.Lock()
+        self._unsub_refresh = None
+        self._retry_delay = 0
+        self._stopped = False
+        self._warned = False
+        self._invalid_logged = False
+
+    def valid(self, margin=0):
+        if not self.token:
+            return False
+        return self.expires_at is None or time.time() < self.expires_at - margin
+
+    async def async_get_token(self):
+        """返回可用的 Token；只有没有可用 Token 时才在调用方路径上登录"""
+        if not self._loaded:
+            await self._async_load()
+        if self._login is None:
+            self._check_static_expiry()
+            return self.token
+        if not self.valid():
+            await self.async_refresh()
+        return self.token
+
+    async def async_invalidate(self, token=None):
+        """接口返回认证错误时调用，之后重新登录一次"""
+        if token is not None and token != self.token:
+            # 其它调用已经换过 Token
+            return self.token
+        if self._login is None:
+            if not self._invalid_logged:
+                self._invalid_logged = True
+                _LOGGER.error("%s Token 已失效，请在集成配置中更新", self._name)
+            return None
+        self.token = None
+        return await self.async_refresh()
+
+    async def async_request(self, request, is_auth_error, *args):
+        """
+        在 executor 中以当前 Token 调用 request(token, *args)，没有可用 Token 时返回 None。
+        is_auth_error(结果) 为真时重试一次：可登录的平台先重新登录，静态 Token 用原 Token 再试，
+        仍然失败才提示用户更新。
+        """
+        token = await self.async_get_token()
+        if not token:
+            return None
+        result = await self.hass.async_add_executor_job(request, token, *args)
+        if not is_auth_error(result):
+            return result
+        retry_token = token if self._login is None else await self.async_invalidate(token)
+        if not retry_token:
+            return result
+        result = await self.hass.async_add_executor_job(request, retry_token, *args)
+        if is_auth_error(result) and self._login is None:
+            await self.async_invalidate(token)
+        return result
+
+    async def async_refresh(self):
+        async with self._lock:
+            if self.valid(TOKEN_REFRESH_MARGIN):
+                return self.token
+            try:
+                result = await self.hass.async_add_executor_job(self._login)
+            except Exception as e:
+                _LOGGER.warning("%s Token 刷新出错: %s", self._name, e)
+                result = None
+            if not result:
+                self._retry_delay = min(max(self._retry_delay * 2, TOKEN_RETRY_MIN), TOKEN_RETRY_MAX)
+                _LOGGER.warning("%s Token 刷新失败，%d 秒后重试", self._name, self._retry_delay)
+                self._schedule_refresh(self._retry_delay)
+                return self.token if self.valid() else None
+            self._retry_delay = 0
+            self.token, expires_in = result
+            self.expires_at = time.time() + float(expires_in) if expires_in else jwt_expiry(self.token)
+            _LOGGER.debug("%s Token refreshed, expires at %s", self._name, self.expires_at)
+            if self._store:
+                await self._store.async_save({"token": self.token, "expires_at": self.expires_at})
+            self._schedule_refresh()
+            return self.token
+
+    def _schedule_refresh(self, delay=None):
+        """安排后台刷新：默认在到期前 TOKEN_REFRESH_MARGIN 秒，失败重试时传入 delay"""
+        if self._unsub_refresh:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+        if self._stopped:
+            # 条目已卸载，进行中的刷新完成后不再安排下一次
+            return
+        if delay is None:
+            if self.expires_at is None:
+                return
+            delay = max(self.expires_at - TOKEN_REFRESH_MARGIN - time.time(), 0)
+
+        async def _refresh(_now):
+            self._unsub_refresh = None
+            await self.async_refresh()
+
+        self._unsub_refresh = async_call_later(self.hass, delay, _refresh)
+
+    async def _async_load(self):
+        self._loaded = True
+        stored = await self._store.async_load() or {}
+        if stored.get("token") and (stored.get("expires_at") or 0) > time.time():
+            self.token = stored["token"]
+            self.expires_at = stored["expires_at"]
+            self._schedule_refresh()
+
+    def _check_static_expiry(self):
+        if self._warned or self.expires_at is None:
+            return
+        remaining = self.expires_at - time.time()
+        if remaining < TOKEN_EXPIRY_WARNING:
+            self._warned = True
+            _LOGGER.warning("%s Token %s，请及时在集成配置中更新", self._name,
+                            "已过期" if remaining <= 0 else f"将在 {int(remaining / 3600)} 小时后过期")
+
+    def stop(self):
+        """取消后台刷新；之后不再安排新的刷新"""
+        self._stopped = True
+        if self._unsub_refresh:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+
+
+def get_token_manager(hass, key, name, **kwargs):
+    """同一账号的轮询、按钮和开关共用一个 TokenManager，避免各自登录"""
+    managers = hass.data.setdefault(DOMAIN, {}).setdefault(TOKEN_MANAGERS, {})
+    if key not in managers:
+        managers[key] = TokenManager(hass, name, **kwargs)
+    return managers[key]
+
+
+def remove_token_manager(hass, key):
+    """条目卸载时停止并移除共用的 TokenManager"""
+    manager = hass.data.get(DOMAIN, {}).get(TOKEN_MANAGERS, {}).pop(key, None)
+    if manager is not None:
+        manager.stop()
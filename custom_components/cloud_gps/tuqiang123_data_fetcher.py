@@ -13,6 +13,8 @@ from async_timeout import timeout
 from aiohttp.client_exceptions import ClientConnectorError
 from homeassistant.helpers.aiohttp_client import async_create_clientsession
 from homeassistant.helpers.update_coordinator import UpdateFailed
+from homeassistant.helpers.storage import Store
+from homeassistant.util import slugify
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 from homeassistant.const import (
@@ -29,17 +31,31 @@ from .const import (
     UNDO_UPDATE_LISTENER,
     CONF_ATTR_SHOW,
     CONF_UPDATE_INTERVAL,
+    CONF_REFRESH_BATCH_SIZE,
 )
 
+from .inventory import get_inventory
+from .address_cache import MovementTracker, get_address_cache
+
 _LOGGER = logging.getLogger(__name__)
 
 TUQIANG_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36'
 TUQIANG123_API_HOST = "https://www.tuqiang123.com"   # http://www.tuqiangol.com 或者 http://www.tuqiang123.com
+DEVICE_LIST_PAGE_SIZE = 100
+DEVICE_LIST_MAX_PAGES = 50
+
+# 今日里程的刷新间隔
+TODAY_MILEAGE_INTERVAL = 3600
+# 最近 MILEAGE_SETTLE_DAYS 天的里程平台可能还在补算，按 MILEAGE_SETTLE_INTERVAL 重新查询；
+# 更早的日期连续 MILEAGE_EMPTY_RETRIES 次没有数据才按 0 计
+MILEAGE_SETTLE_DAYS = 2
+MILEAGE_SETTLE_INTERVAL = 6 * 3600
+MILEAGE_EMPTY_RETRIES = 3
 
 class DataFetcher:
     """fetch the cloud gps data"""
 
-    def __init__(self, hass, username, password, device_imei, location_key):
+    def __init__(self, hass, username, password, device_imei, location_key, options=None):
         self.hass = hass
         self.location_key = location_key
         self.username = username
@@ -48,13 +64,21 @@ class DataFetcher:
         self.session_tuqiang123 = requests.session()
         self.userid = None
         self.usertype = None
-        self._lat_old = 0
-        self._lon_old = 0
+        self._movement = MovementTracker()
+        self._address_cache = get_address_cache(hass, "tuqiang123.com")
         self.deviceinfo = {}
         self.trackerdata = {}
         self.address = {}
         self.totalkm = {}
         self.dis = {}
+        self._inventory = get_inventory(hass, "tuqiang123.com", username)
+        # 每台设备的里程表：本月/今年已结算里程和最近几天的里程，持久化后月和年里程在本地累加
+        self._mileage = None
+        self._mileage_dirty = False
+        self._mileage_empty = {}
+        self._mileage_store = Store(hass, version=1, key=f"cloud_gps_{slugify(location_key)}_mileage")
+        # 每次 /console/refresh 请求携带的 IMEI 数量
+        self._refresh_batch_size = max(1, int((options or {}).get(CONF_REFRESH_BATCH_SIZE, 50)))
 
         headers = {
             'User-Agent': TUQIANG_USER_AGENT
@@ -91,28 +115,57 @@ class DataFetcher:
         self.userid = resp['data']['user']['userId']
         self.usertype = resp['data']['user']['type']
 
-    def _get_device_info(self, imei_sn):
+    def _get_device_list(self):
+        """分页拉取账号下的全部设备"""
         url = TUQIANG123_API_HOST + '/device/list'
-        p_data = {
-            'dateType': 'activation',
-            'equipment.userId': self.userid
-        }
-        resp = self.session_tuqiang123.post(url, data=p_data)
+        devices = []
+        last_page = None
+        for page_no in range(1, DEVICE_LIST_MAX_PAGES + 1):
+            p_data = {
+                'dateType': 'activation',
+                'equipment.userId': self.userid,
+                'pageNo': str(page_no),
+                'pageSize': str(DEVICE_LIST_PAGE_SIZE)
+            }
+            resp = self.session_tuqiang123.post(url, data=p_data)
+            data = resp.json()['data']
+            result = data['result'] or []
+            # 服务端忽略 pageNo 时每页内容相同，遇到重复页即停止
+            page = [str(device.get("imei")) for device in result]
+            if page == last_page:
+                break
+            last_page = page
+            devices.extend(result)
+            total = data.get('totalCount')
+            if len(result) < DEVICE_LIST_PAGE_SIZE or (isinstance(total, int) and len(devices) >= total):
+                return devices
+        else:
+            _LOGGER.warning("途强在线 设备列表超过 %d 页，只读取了前 %d 台设备", DEVICE_LIST_MAX_PAGES, len(devices))
+        return devices
 
-        return resp.json()['data']['result'][0]
+    async def _async_get_device_list(self):
+        return await self.hass.async_add_executor_job(self._get_device_list)
 
-    def _get_device_tracker(self, imei_sn):
+    async def _get_device_info(self, imei_sn):
+        return await self._inventory.async_get(imei_sn, self._async_get_device_list)
+
+    def _get_device_trackers(self, imeis):
+        """一次请求多个 IMEI 的实时数据，返回 imei -> 数据"""
         url = TUQIANG123_API_HOST + '/console/refresh'
         p_data = {
             'choiceUserId': self.userid,
-            'normalImeis': str(imei_sn),
+            'normalImeis': ','.join(str(imei_sn) for imei_sn in imeis),
             'userType': self.usertype,
             'followImeis': '',
             'userId': self.userid,
             'stock': '2'
         }
         resp = self.session_tuqiang123.post(url, data=p_data)
-        return resp.json()['data']['normalList'][0]
+        normal_list = resp.json()['data']['normalList'] or []
+        return {str(item.get("imei")): item for item in normal_list}
+
+    def _get_device_tracker(self, imei_sn):
+        return self._get_device_trackers([imei_sn]).get(str(imei_sn))
 
     def _get_device_mileage(self, imei_sn, start_time, end_time):
         url = TUQIANG123_API_HOST + '/mileageReportController/getList'
@@ -138,6 +191,128 @@ class DataFetcher:
         resp = self.session_tuqiang123.get(url)
         return resp.json()['msg']
 
+    async def _query_mileage(self, imei, start_day, end_day, label):
+        """查询 start_day 到 end_day（含）的里程，失败或没有有效数据时返回 None"""
+        start_time = f"{start_day.strftime('%Y-%m-%d')} 00:00"
+        end_time = f"{end_day.strftime('%Y-%m-%d')} 23:59"
+        data = None
+        try:
+            async with timeout(10):
+                data =  await self.hass.async_add_executor_job(self._get_device_mileage, imei, start_time, end_time)
+                _LOGGER.debug("途强在线 %s %s里程数据结果: %s", imei, label, data)
+        except ClientConnectorError as error:
+            _LOGGER.error("途强在线 %s 连接错误: %s", imei, error)
+            return None
+        except asyncio.TimeoutError:
+            _LOGGER.error("途强在线 %s 获取数据超时 (10秒)", imei)
+            return None
+        except Exception as e:
+            await self.hass.async_add_executor_job(self._login, self.username, self.password)
+            raise UpdateFailed(e)
+        if data and len(data)>0:
+            try:
+                return float(data[0]["dis"])
+            except (KeyError, ValueError, TypeError):
+                _LOGGER.debug("途强在线 %s %s里程数据无效: %s", imei, label, data[0])
+        # 只统计请求成功但没有数据的次数，网络错误不计入
+        self._mileage_empty[(imei, label)] = self._mileage_empty.get((imei, label), 0) + 1
+        return None
+
+    def _settled_empty(self, imei, key, retries=MILEAGE_EMPTY_RETRIES):
+        """已结算的日期或区间连续 retries 次查询成功但没有数据时视为 0"""
+        return self._mileage_empty.get((imei, key), 0) >= retries
+
+    async def _query_settled(self, imei, start_day, end_day, retries=MILEAGE_EMPTY_RETRIES):
+        """查询已结束日期的里程，平台连续 retries 次返回空数据时按 0 计，请求失败返回 None"""
+        key = start_day.strftime('%Y-%m-%d') if start_day == end_day else f"{start_day:%Y-%m-%d}~{end_day:%Y-%m-%d}"
+        dis = await self._query_mileage(imei, start_day, end_day, key)
+        if dis is None and self._settled_empty(imei, key, retries):
+            dis = 0
+        return dis
+
+    async def _mileage_base(self, imei, base, start, end, recent):
+        """
+        返回 start 到 end（含）的已结算里程 {"start", "end", "dis"}，失败时返回 None。
+        起点不变且新结算的日期都在最近几天的记录中时直接累加，否则用一次区间查询重新取得。
+        """
+        start_key = start.strftime('%Y-%m-%d')
+        end_key = end.strftime('%Y-%m-%d')
+        if end < start:
+            return {"start": start_key, "end": end_key, "dis": 0}
+        if base and base.get("start") == start_key:
+            if base.get("end") == end_key:
+                return base
+            last = datetime.date.fromisoformat(base["end"])
+            added = [(last + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(1, (end - last).days + 1)]
+            if added and all(key in recent for key in added):
+                return {"start": start_key, "end": end_key, "dis": round(base["dis"] + sum(recent[key] for key in added), 2)}
+        dis = await self._query_settled(imei, start, end)
+        if dis is None:
+            return None
+        return {"start": start_key, "end": end_key, "dis": dis}
+
+    async def _update_mileage(self, imei):
+        """
+        快速层：今日里程每 TODAY_MILEAGE_INTERVAL 查询一次。
+        慢速层：最近 MILEAGE_SETTLE_DAYS 天平台可能还在补算，日期变化后及每 MILEAGE_SETTLE_INTERVAL 重新查询。
+        更早的日期视为已结算：本月和今年的已结算里程各用一次区间查询取得并持久化，
+        之后每天只把刚结算的日期累加进去，月和年里程在本地相加得到。
+        """
+        now = datetime.datetime.now()
+        today = now.date()
+        today_key = today.strftime('%Y-%m-%d')
+        table = self._mileage.get(imei)
+        if not isinstance(table, dict) or "recent" not in table:
+            # 旧格式（逐日/逐月表）不再使用，重新建立
+            table = self._mileage[imei] = {"recent": {}, "recent_date": None, "recent_time": 0, "month": None, "year": None}
+        recent = table["recent"]
+
+        # 跨过零点后上一天的今日里程作废，立即按新日期重新查询
+        if self.dis[imei].get("today_dis_date") != today_key:
+            self.dis[imei]["today_dis"] = 0
+            self.dis[imei]["today_dis_time"] = 0
+            self.dis[imei]["today_dis_date"] = today_key
+
+        if int(now.timestamp()) - int(self.dis[imei]["today_dis_time"]) >= TODAY_MILEAGE_INTERVAL:
+            self.dis[imei]["today_dis_time"] = int(now.timestamp())
+            today_dis = await self._query_mileage(imei, today, today, "今日")
+            if today_dis is not None:
+                self.dis[imei]["today_dis"] = today_dis
+
+        recent_days = [today - datetime.timedelta(days=i) for i in range(1, MILEAGE_SETTLE_DAYS + 1)]
+        settled_end = recent_days[-1] - datetime.timedelta(days=1)
+        month_start = today.replace(day=1)
+        year_start = today.replace(month=1, day=1)
+
+        # 先用最近几天的记录推进已结算里程，再刷新最近几天
+        for name, start in (("month", month_start), ("year", year_start)):
+            base = await self._mileage_base(imei, table[name], start, settled_end, recent)
+            if base is not None and base != table[name]:
+                table[name] = base
+                self._mileage_dirty = True
+
+        if table["recent_date"] != today_key or now.timestamp() - table["recent_time"] >= MILEAGE_SETTLE_INTERVAL:
+            table["recent_date"] = today_key
+            table["recent_time"] = now.timestamp()
+            for day in recent_days:
+                # 最近几天会再次查询，平台返回空数据即按 0 计
+                dis = await self._query_settled(imei, day, day, retries=1)
+                if dis is not None:
+                    recent[day.strftime('%Y-%m-%d')] = dis
+            for key in [key for key in recent if key not in {day.strftime('%Y-%m-%d') for day in recent_days}]:
+                del recent[key]
+            self._mileage_dirty = True
+
+        today_dis = float(self.dis[imei]["today_dis"] or 0)
+        self.dis[imei]["yesterday_dis"] = recent.get(recent_days[0].strftime('%Y-%m-%d'), 0)
+        for name, start in (("month", month_start), ("year", year_start)):
+            base = table[name]
+            if base is None or base["start"] != start.strftime('%Y-%m-%d'):
+                # 区间查询还没有成功，保留原来的值
+                continue
+            recent_dis = sum(recent.get(day.strftime('%Y-%m-%d'), 0) for day in recent_days if day >= start)
+            self.dis[imei][f"{name}_dis"] = round(base["dis"] + recent_dis + today_dis, 2)
+
     def time_diff(self, timestamp):
             result = datetime.datetime.now() - datetime.datetime.fromtimestamp(timestamp)
             hours = int(result.seconds / 3600)
@@ -155,26 +330,42 @@ class DataFetcher:
     async def get_data(self):
 
         _LOGGER.debug(self.device_imei)
+        if self._mileage is None:
+            self._mileage = await self._mileage_store.async_load() or {}
         if self.userid is None or self.usertype is None:
             await self.hass.async_add_executor_job(self._login, self.username, self.password)
 
+        # 所有设备的实时数据按批次请求，再按 imei 分发
+        trackers = {}
+        imeis = list(self.device_imei)
+        for i in range(0, len(imeis), self._refresh_batch_size):
+            chunk = imeis[i:i + self._refresh_batch_size]
+            try:
+                async with timeout(10):
+                    trackers.update(await self.hass.async_add_executor_job(self._get_device_trackers, chunk))
+                    _LOGGER.debug("途强在线 %s 最终数据结果: %s", chunk, trackers)
+            except ClientConnectorError as error:
+                _LOGGER.error("途强在线 %s 连接错误: %s", chunk, error)
+            except asyncio.TimeoutError:
+                _LOGGER.error("途强在线 %s 获取数据超时 (10秒)", chunk)
+            except Exception as e:
+                await self.hass.async_add_executor_job(self._login, self.username, self.password)
+                raise UpdateFailed(e)
+
         for imei in self.device_imei:
             _LOGGER.debug("Requests imei: %s", imei)
             self.dis[imei] = self.dis.get(imei, {})
             self.dis[imei]["today_dis"]  = self.dis[imei].get("today_dis", 0)
             self.dis[imei]["today_dis_time"]  = self.dis[imei].get("today_dis_time", 0)
             self.dis[imei]["yesterday_dis"]  = self.dis[imei].get("yesterday_dis", 0)
-            self.dis[imei]["yesterday_dis_time"]  = self.dis[imei].get("yesterday_dis_time", 0)
             self.dis[imei]["month_dis"]  = self.dis[imei].get("month_dis", 0)
-            self.dis[imei]["month_dis_time"]  = self.dis[imei].get("month_dis_time", 0)
             self.dis[imei]["year_dis"]  = self.dis[imei].get("year_dis", 0)
-            self.dis[imei]["year_dis_time"]  = self.dis[imei].get("year_dis_time", 0)
 
             if not self.deviceinfo.get(imei):
 
                 try:
                     async with timeout(10):
-                        infodata =  await self.hass.async_add_executor_job(self._get_device_info, imei)
+                        infodata =  await self._get_device_info(imei)
                 except (
                     ClientConnectorError
                 ) as error:
@@ -187,18 +378,12 @@ class DataFetcher:
                     self.deviceinfo[imei]["device_model"] = "途强在线GPS"
                     self.deviceinfo[imei]["sw_version"] = infodata["mcType"]
                     self.deviceinfo[imei]["expiration"] = infodata["expiration"]
-            data = None
-            try:
-                async with timeout(10):
-                    data =  await self.hass.async_add_executor_job(self._get_device_tracker, imei)
-                    _LOGGER.debug("途强在线 %s 最终数据结果: %s", imei, data)
-            except ClientConnectorError as error:
-                _LOGGER.error("途强在线 %s 连接错误: %s", imei, error)
-            except asyncio.TimeoutError:
-                _LOGGER.error("途强在线 %s 获取数据超时 (10秒)", imei)
-            except Exception as e:
-                await self.hass.async_add_executor_job(self._login, self.username, self.password)
-                raise UpdateFailed(e)
+
+            # 设备清单中还没有该设备（清单刷新受限流或账号列表未包含）时本轮跳过，不影响其它设备
+            if not self.deviceinfo.get(imei):
+                _LOGGER.warning("途强在线 %s 设备清单中暂无该设备，本轮跳过", imei)
+                continue
+            data = trackers.get(str(imei))
 
 
             if data:
@@ -256,10 +441,12 @@ class DataFetcher:
                 laststoptime = data["gpsTime"]
                 positionType = data["positionType"] if speed==0 else ""
 
-                if self._lat_old != thislat or self._lon_old != thislon:
-                    self.address[imei] = await self.hass.async_add_executor_job(self._get_device_address, thislat, thislon)
-                    self._lat_old = thislat
-                    self._lon_old = thislon
+                # 只有该设备真正移动时才重新获取地址，附近已查询过的地址直接复用
+                if self._movement.moved(imei, thislat, thislon) or imei not in self.address:
+                    self.address[imei] = await self._address_cache.async_lookup(
+                        thislat, thislon,
+                        lambda: self.hass.async_add_executor_job(self._get_device_address, thislat, thislon)
+                    )
 
                 address = self.address.get(imei, "未知")
 
@@ -270,95 +457,7 @@ class DataFetcher:
                     totalKm = self.totalkm.get(imei, 0)
 
 
-                if int(datetime.datetime.now().timestamp()) - int(self.dis[imei]["today_dis_time"] ) >= 600:
-                    today_str = datetime.datetime.now().strftime('%Y-%m-%d')
-                    start_time = f"{today_str} 00:00"
-                    end_time = f"{today_str} 23:59"
-                    data = None
-                    try:
-                        async with timeout(10):
-                            data =  await self.hass.async_add_executor_job(self._get_device_mileage, imei, start_time, end_time)
-                            _LOGGER.debug("途强在线 %s 今日里程数据结果: %s", imei, data)
-                            self.dis[imei]["today_dis"]  = int(datetime.datetime.now().timestamp())
-                    except ClientConnectorError as error:
-                        _LOGGER.error("途强在线 %s 连接错误: %s", imei, error)
-                    except asyncio.TimeoutError:
-                        _LOGGER.error("途强在线 %s 获取数据超时 (10秒)", imei)
-                    except Exception as e:
-                        raise UpdateFailed(e)
-                    if data and len(data)>0:
-                        self.dis[imei]["today_dis"] = data[0].get("dis")
-                    else:
-                        self.dis[imei]["today_dis"] = 0
-
-                if int(datetime.datetime.now().timestamp()) - int(self.dis[imei]["yesterday_dis_time"]) >= 3600:
-                    today = datetime.date.today()
-                    yesterday = today - datetime.timedelta(days=1)
-                    yesterday_str = yesterday.strftime('%Y-%m-%d')
-                    start_time = f"{yesterday_str} 00:00"
-                    end_time = f"{yesterday_str} 23:59"
-                    data = None
-                    try:
-                        async with timeout(10):
-                            data =  await self.hass.async_add_executor_job(self._get_device_mileage, imei, start_time, end_time)
-                            _LOGGER.debug("途强在线 %s 昨日里程数据结果: %s", imei, data)
-                            self.dis[imei]["yesterday_dis_time"] =  int(datetime.datetime.now().timestamp())
-                    except ClientConnectorError as error:
-                        _LOGGER.error("途强在线 %s 连接错误: %s", imei, error)
-                    except asyncio.TimeoutError:
-                        _LOGGER.error("途强在线 %s 获取数据超时 (10秒)", imei)
-                    except Exception as e:
-                        await self.hass.async_add_executor_job(self._login, self.username, self.password)
-                        raise UpdateFailed(e)
-                    if data and len(data)>0:
-                        self.dis[imei]["yesterday_dis"]  =  data[0].get("dis")
-                    else:
-                        self.dis[imei]["yesterday_dis"]  = 0
-
-                if int(datetime.datetime.now().timestamp()) - int(self.dis[imei]["month_dis_time"]) >= 3600:
-                    current_month = datetime.datetime.now().strftime("%Y-%m")
-                    start_time = f"{current_month}-01 00:00"
-                    end_time = f"{current_month}-{datetime.datetime.now().day} 23:59"
-                    data = None
-                    try:
-                        async with timeout(10):
-                            data =  await self.hass.async_add_executor_job(self._get_device_mileage, imei, start_time, end_time)
-                            _LOGGER.debug("途强在线 %s 本月里程数据结果: %s", imei, data)
-                            self.dis[imei]["month_dis_time"]=  int(datetime.datetime.now().timestamp())
-                    except ClientConnectorError as error:
-                        _LOGGER.error("途强在线 %s 连接错误: %s", imei, error)
-                    except asyncio.TimeoutError:
-                        _LOGGER.error("途强在线 %s 获取数据超时 (10秒)", imei)
-                    except Exception as e:
-                        await self.hass.async_add_executor_job(self._login, self.username, self.password)
-                        raise UpdateFailed(e)
-                    if data and len(data)>0:
-                        self.dis[imei]["month_dis"]= data[0].get("dis")
-                    else:
-                        self.dis[imei]["month_dis"] = 0
-
-                if int(datetime.datetime.now().timestamp()) - int(self.dis[imei]["year_dis_time"]) >= 3600:
-                    current_year = datetime.datetime.now().strftime("%Y")
-                    start_time = f"{current_year}-01-01 00:00"
-                    end_time = f"{current_year}-12-31 23:59"
-                    data = None
-                    try:
-                        async with timeout(10):
-                            data =  await self.hass.async_add_executor_job(self._get_device_mileage, imei, start_time, end_time)
-                            _LOGGER.debug("途强在线 %s 今年里程数据结果: %s", imei, data)
-                            self.dis[imei]["year_dis_time"] =  int(datetime.datetime.now().timestamp())
-                    except ClientConnectorError as error:
-                        _LOGGER.error("途强在线 %s 连接错误: %s", imei, error)
-                    except asyncio.TimeoutError:
-                        _LOGGER.error("途强在线 %s 获取数据超时 (10秒)", imei)
-                    except Exception as e:
-                        await self.hass.async_add_executor_job(self._login, self.username, self.password)
-                        raise UpdateFailed(e)
-                    if data and len(data)>0:
-                        self.dis[imei]["year_dis"] = data[0].get("dis")
-                    else:
-                        self.dis[imei]["year_dis"]  = 0
-
+                await self._update_mileage(imei)
 
                 attrs ={
                     "course":direction,
@@ -385,6 +484,10 @@ class DataFetcher:
 
                 self.trackerdata[imei] = {"location_key":self.location_key+imei,"deviceinfo":self.deviceinfo[imei],"thislat":thislat,"thislon":thislon,"imei":imei,"status":status,"attrs":attrs}
 
+        if self._mileage_dirty:
+            await self._mileage_store.async_save(self._mileage)
+            self._mileage_dirty = False
+
         return self.trackerdata
 
 class GetDataError(Exception):
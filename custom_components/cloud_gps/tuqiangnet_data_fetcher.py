@@ -31,11 +31,19 @@ from .const import (
     CONF_UPDATE_INTERVAL,
 )
 
+from .inventory import get_inventory
+from .address_cache import MovementTracker, get_address_cache
+
 _LOGGER = logging.getLogger(__name__)
 
 TUQIANGNET_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'
 TUQIANGNET_API_HOST = "http://www.tuqiang.net"
 
+# 总里程变化缓慢，按较长的间隔单独刷新
+TOTAL_MILEAGE_INTERVAL = 1800
+# 批量位置请求返回非批量结果后，间隔多久（秒）再尝试批量
+BATCH_GPS_RETRY = 3600
+
 class DataFetcher:
     """fetch the cloud gps data"""
 
@@ -47,12 +55,15 @@ class DataFetcher:
         self.device_imei = device_imei        
         self.session_tuqiangnet = requests.session()
         self.cloudpgs_token = None
-        self._lat_old = 0
-        self._lon_old = 0
+        self._movement = MovementTracker()
+        self._address_cache = get_address_cache(hass, "tuqiang.net")
         self.deviceinfo = {}
         self.trackerdata = {}
         self.address = {}
         self.totalkm = {}
+        self._totalkm_time = {}
+        self._batch_gps_after = 0  # /redis/getGps 批量请求不可用时，到此时刻（monotonic）之前逐台请求
+        self._inventory = get_inventory(hass, "tuqiang.net", username)
         
         headers = {
             'User-Agent': TUQIANGNET_USER_AGENT
@@ -77,14 +88,22 @@ class DataFetcher:
         else:
             return False
             
-    def _get_device_info(self, imei_sn):        
+    def _get_device_list(self, imeis):
+        """一次请求多个 IMEI 的设备资料"""
         url = TUQIANGNET_API_HOST + '/device/getDeviceList'
         p_data = {
-            "imeis": imei_sn,
+            "imeis": ",".join(str(imei_sn) for imei_sn in imeis),
             "token": self.cloudpgs_token
         }
         resp = self.session_tuqiangnet.post(url, data=p_data)
-        return resp.json()['data'][0]
+        return resp.json()['data'] or []
+
+    async def _async_get_device_list(self):
+        return await self.hass.async_add_executor_job(self._get_device_list, self.device_imei)
+
+    async def _get_device_info(self, imei_sn):
+        # getDeviceList 按 IMEI 查询，只对本条目启用的设备负责
+        return await self._inventory.async_get(imei_sn, self._async_get_device_list, scope=self.device_imei)
             
     def _get_device_tracker(self, imei_sn):
         url = TUQIANGNET_API_HOST + '/redis/getGps'
@@ -94,6 +113,54 @@ class DataFetcher:
         }
         resp = self.session_tuqiangnet.post(url, data=p_data)
         return resp.json()['data']
+
+    def _get_device_trackers_batch(self, imeis):
+        """
+        尝试用逗号分隔的 IMEI 一次获取多台设备的位置。
+        返回 imei -> 数据；接口不支持批量（未返回带 imei 的列表）时返回 None。
+        """
+        data = self._get_device_tracker(",".join(str(imei_sn) for imei_sn in imeis))
+        if not isinstance(data, list) or not all(isinstance(item, dict) and item.get("imei") for item in data):
+            return None
+        return {str(item["imei"]): item for item in data}
+
+    async def _get_device_trackers(self):
+        """
+        获取所有设备的位置：接口支持批量时一次请求，否则并发逐台请求。
+        """
+        imeis = [str(imei) for imei in self.device_imei]
+        if len(imeis) > 1 and time.monotonic() >= self._batch_gps_after:
+            try:
+                async with timeout(10):
+                    trackers = await self.hass.async_add_executor_job(self._get_device_trackers_batch, imeis)
+            except (ClientConnectorError, asyncio.TimeoutError):
+                raise
+            except Exception as e:
+                # 请求出错属于临时故障，本轮逐台请求，下一轮仍尝试批量
+                _LOGGER.debug("途强物联 批量获取位置失败，本轮改为逐台请求: %s", repr(e))
+            else:
+                if trackers is not None:
+                    return trackers
+                # 接口正常应答但不是批量结果，视为不支持，过一段时间再探测
+                self._batch_gps_after = time.monotonic() + BATCH_GPS_RETRY
+                _LOGGER.debug("途强物联 /redis/getGps 不支持批量请求，%d 秒内逐台请求", BATCH_GPS_RETRY)
+
+        async def fetch(imei):
+            async with timeout(10):
+                return await self.hass.async_add_executor_job(self._get_device_tracker, imei)
+
+        results = await asyncio.gather(*(fetch(imei) for imei in imeis), return_exceptions=True)
+        trackers = {}
+        for imei, result in zip(imeis, results):
+            if isinstance(result, ClientConnectorError):
+                _LOGGER.error("途强物联 %s 连接错误: %s", imei, result)
+            elif isinstance(result, asyncio.TimeoutError):
+                _LOGGER.error("途强物联 %s 获取数据超时 (10秒)", imei)
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                trackers[imei] = result
+        return trackers
         
     def _get_device_totalMileage(self, imei_sn):
         url = TUQIANGNET_API_HOST + '/redis/getDeviceOther'
@@ -135,13 +202,25 @@ class DataFetcher:
         if self.cloudpgs_token is None:
             await self.hass.async_add_executor_job(self._login, self.username, self.password)        
         _LOGGER.debug(self.device_imei)
+        trackers = {}
+        try:
+            trackers = await self._get_device_trackers()
+            _LOGGER.debug("最终数据结果: %s", trackers)
+        except ClientConnectorError as error:
+            _LOGGER.error("连接错误: %s", error)
+        except asyncio.TimeoutError:
+            _LOGGER.error("获取数据超时 (10秒)")
+        except Exception as e:
+            await self.hass.async_add_executor_job(self._login, self.username, self.password)                
+            raise UpdateFailed(e)
+
         for imei in self.device_imei:
             _LOGGER.debug("Requests imei: %s", imei)
             if not self.deviceinfo.get(imei):
                 infodata = None
                 try:
                     async with timeout(10): 
-                        infodata =  await self.hass.async_add_executor_job(self._get_device_info, imei)
+                        infodata =  await self._get_device_info(imei)
                         _LOGGER.debug("途强物联 %s 最终数据结果: %s", imei, infodata)
                 except ClientConnectorError as error:
                     _LOGGER.error("途强物联 %s 连接错误: %s", imei, error)
@@ -155,19 +234,13 @@ class DataFetcher:
                     self.deviceinfo[imei]["device_model"] = "途强物联GPS"
                     self.deviceinfo[imei]["sw_version"] = infodata["deviceModel"]
                     self.deviceinfo[imei]["expiration"] = infodata["expirationTime"]
+
+            # 设备清单中还没有该设备（清单刷新受限流或账号列表未包含）时本轮跳过，不影响其它设备
+            if not self.deviceinfo.get(imei):
+                _LOGGER.warning("途强物联 %s 设备清单中暂无该设备，本轮跳过", imei)
+                continue
             
-            data = None            
-            try:
-                async with timeout(10): 
-                    data =  await self.hass.async_add_executor_job(self._get_device_tracker, imei)
-                    _LOGGER.debug("最终数据结果: %s", data)
-            except ClientConnectorError as error:
-                _LOGGER.error("连接错误: %s", error)
-            except asyncio.TimeoutError:
-                _LOGGER.error("获取数据超时 (10秒)")
-            except Exception as e:
-                await self.hass.async_add_executor_job(self._login, self.username, self.password)                
-                raise UpdateFailed(e)
+            data = trackers.get(str(imei))
 
             if data:
                 querytime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -210,14 +283,23 @@ class DataFetcher:
                     powerStatus = "已断开"
                     status = "外电已断开"
                     
-                if self._lat_old != thislat or self._lon_old != thislon:
-                    self.address[imei] = await self.hass.async_add_executor_job(self._get_device_address, thislat, thislon)
-                    self.totalkm[imei] = await self.hass.async_add_executor_job(self._get_device_totalMileage, imei)
-                    self._lat_old = thislat
-                    self._lon_old = thislon                
+                # 只有该设备真正移动时才重新获取地址，附近已查询过的地址直接复用
+                if self._movement.moved(imei, thislat, thislon) or imei not in self.address:
+                    self.address[imei] = await self._address_cache.async_lookup(
+                        thislat, thislon,
+                        lambda: self.hass.async_add_executor_job(self._get_device_address, thislat, thislon)
+                    )
+
+                if time.time() - self._totalkm_time.get(imei, 0) >= TOTAL_MILEAGE_INTERVAL:
+                    try:
+                        async with timeout(10):
+                            self.totalkm[imei] = await self.hass.async_add_executor_job(self._get_device_totalMileage, imei)
+                        self._totalkm_time[imei] = time.time()
+                    except Exception as e:
+                        _LOGGER.error("途强物联 %s 获取总里程失败: %s", imei, repr(e))
                 
                 address = self.address[imei]
-                totalKm = self.totalkm[imei]
+                totalKm = self.totalkm.get(imei, 0)
                 
                 attrs = {
                     "course":direction,